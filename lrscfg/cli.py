@@ -13,8 +13,9 @@ def pull_moas(tag):
     
 @lrscfg.command()
 @click.option("--version","-v", required=False, default=None, type=str, help="MOAS version tag (if not provided latest pulled MOAS used)")
-def activate_moas(version):
-    Client().activate_moas(version)
+@click.option("--force", "-f", is_flag=True, help="Push the VGA and SiPM configs of all the boards, also the unchanged ones")
+def activate_moas(version, force):
+    Client().activate_moas(version, force=force)
     
 @lrscfg.command()
 def ramp_down_sipm():
@@ -1,16 +1,11 @@
-import requests
 from datetime import datetime
-import json
-import filecmp, os, glob
-import re
-
-import lrscfg.VGA_config_maker as VGA_config_maker
-import lrscfg.set_VGAS as set_VGAS
-import lrscfg.SIPM_config_maker as SIPM_config_maker
-import lrscfg.set_SIPMs as set_SIPMs
-from lrscfg.db_handler import DB_Handler
+import filecmp, os
+
 from lrscfg.config import Config
-import lrscfg.threshold_handler as threshold_handler
+from lrscfg.versions import get_resolver
+
+# The device modules (pandas, ssh to the supplies) and the database handler are
+# imported by the commands using them, the queries stay fast
 
 
 class Client():
@@ -18,9 +13,18 @@ class Client():
         config_settings = Config().parse_yaml()
         self.moas_path = config_settings["moas_path"]
         self.foas_path = config_settings["foas_path"]
+        self.resolver = get_resolver()
         self.latest_moas = self.get_latest_moas()
         self.latest_foas = self.get_latest_foas()
-        self.db = DB_Handler()
+        self._db = None
+
+    @property
+    def db(self):
+        # Only opened by the commands writing to the database
+        if self._db is None:
+            from lrscfg.db_handler import DB_Handler
+            self._db = DB_Handler()
+        return self._db
 
     def pull_moas(self, tag):
         my_date = datetime.now()
@@ -51,27 +55,16 @@ class Client():
         return file_name
     
     def get_latest_moas(self):
-        file_type = r"MOAS_*.csv"
-        files = glob.glob(self.moas_path + file_type)
-        if not files:
+        version = self.resolver.latest_moas()
+        if not version:
             print("No previous MOAS found")
-            return None
-        latest_file = max(files, key=os.path.getmtime)
-        latest_file = os.path.basename(latest_file)
-        pattern = r"MOAS_(\d{8}_\d{6})\.csv"
-        match = re.search(pattern, latest_file)
-        if match:
-            return match.group(1)
-        else:
-            print("No matching file found!")
-            return None
+        return version
 
     def get_active_moas(self):
-        version = self.db.get_active_configuration()
-        if not version:
+        moas = self.resolver.active_moas()
+        if not moas:
             print("No active MOAS set")
-            return None
-        return "MOAS_" + version + ".csv"
+        return moas
 
     def set_active_moas(self, version):
         if not version:
@@ -87,6 +80,7 @@ class Client():
             if version.startswith('MOAS_'):
                 version = version[5:]
         self.db.update_active_configuration(version)
+        self.resolver.invalidate()
 
     def pull_foas(self, tag):
         my_date = datetime.now()
@@ -116,34 +110,18 @@ class Client():
         return file_name
     
     def get_latest_foas(self):
-        file_type = r"FOAS_*.csv"
-        files = glob.glob(self.foas_path + file_type)
-        if not files:
+        version = self.resolver.latest_foas()
+        if not version:
             print("No previous FOAS found")
-            return None
-        latest_file = max(files, key=os.path.getmtime)
-        latest_file = os.path.basename(latest_file)
-        pattern = r"FOAS_(\d{8}_\d{6})\.csv"
-        match = re.search(pattern, latest_file)
-        if match:
-            return match.group(1)
-        else:
-            print("No matching FOAS file found!")
-            return None
+        return version
 
     def get_active_foas(self):
         """Return the active FOAS filename (e.g. 'FOAS_YYYYMMDD_HHMMSS.csv') or None.
-
-        Preference order: DB method if provided, otherwise a small marker file 'FOAS_active.txt'
-        inside `foas_path` is used as fallback.
         """
-
-        version = self.db.get_active_foas_configuration()
-
-        if not version:
+        foas = self.resolver.active_foas()
+        if not foas:
             print("No active FOAS set")
-            return None
-        return "FOAS_" + version + ".csv"
+        return foas
 
     def set_active_foas(self, version):
         """Set the active FOAS version. `version` may be either the bare version string
@@ -163,20 +141,25 @@ class Client():
                 version = version[5:]
 
         self.db.update_active_foas_configuration(version)
+        self.resolver.invalidate()
         
-    def activate_moas(self,version):
+    def activate_moas(self, version, force=False):
+        import lrscfg.VGA_config_maker as VGA_config_maker
+        import lrscfg.set_VGAS as set_VGAS
+        import lrscfg.SIPM_config_maker as SIPM_config_maker
+        import lrscfg.set_SIPMs as set_SIPMs
         if not version:
             version = self.get_latest_moas()
         print("---Make VGA config---")
         VGA_config_maker.make(version)
         print("---Load VGA configs to devices---")
         # print("Virtually setting VGA configs")
-        set_VGAS.set_VGA()
+        set_VGAS.set_VGA(force=force)
         print("---Make SiPM bias config---")
         SIPM_config_maker.make(version)
         print("---Load SiPM bias configs to devices---")
         # print("Virtually setting SiPM configs")
-        set_SIPMs.set_SIPM()
+        set_SIPMs.set_SIPM(force=force)
         
         print("---Set MOAS as active---")
         self.set_active_moas(version)
@@ -188,6 +171,7 @@ class Client():
         This will call the threshold handler to write thresholds into the ADC64 JSON
         and then set the FOAS version as active in the DB (or marker file).
         """
+        import lrscfg.threshold_handler as threshold_handler
         if not version:
             version = self.get_latest_foas()
         print("---Set FOAS thresholds---")
@@ -202,6 +186,7 @@ class Client():
         print("---FOAS successfully loaded---")
         
     def ramp_down_sipm(self):
+        import lrscfg.set_SIPMs as set_SIPMs
         print("---Ramp down SiPMs---")
         set_SIPMs.set_SIPM_zero()
         print("---Ramp finished. Verify in Grafana!!---")
\ No newline at end of file
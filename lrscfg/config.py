@@ -1,29 +1,261 @@
 import yaml
 import os
+import logging
+import threading
 from datetime import datetime
-import pandas as pd
+from pathlib import Path
 
 REPOSITORY_NAME = f'2x2_LRS_runcontrol'
 CONFIG_PATH = f'/{REPOSITORY_NAME}/config.yaml'
 
+NUMBER = (int, float)
+RELOAD_DELAY = 0.5 # s
+
+# key: (type, required). Keys not listed here are accepted as they are.
+SCHEMA = {
+    'AppHost': (str, True),
+    'AppPort': (int, True),
+    'app_threads': (int, False),
+    'moas_path': (str, False),
+    'moas_url': (str, False),
+    'foas_path': (str, False),
+    'foas_url': (str, False),
+    'db_path': (str, False),
+    'pulser_config_path': (str, False),
+    'vga_config_path': (str, False),
+    'sipm_config_path': (str, False),
+    'sipm_config_path_raspi': (str, False),
+    'sipm_parallel': (bool, False),
+    'sipm_stage': (bool, False),
+    'push_state_path': (str, False),
+    'supplr_monitor_interval': (NUMBER, False),
+    'ssh_transport': (str, False),
+    'ssh_control_dir': (str, False),
+    'ssh_persist': (int, False),
+    'ssh_timeout': (NUMBER, False),
+    'ssh_retries': (int, False),
+    'ssh_local_root': (str, False),
+    'afi_config_path': (str, False),
+    'cur_daq_env_path': (str, False),
+    'adc64_sum_config_path': (str, False),
+    'sum_adc64_serial': (str, False),
+    'command_host': (str, False),
+    'command_ack': (bool, False),
+    'command_timeout': (NUMBER, False),
+    'command_retries': (int, False),
+    'data_path': (str, False),
+    'tail_follow': (bool, False),
+    'file_workers': (int, False),
+    'file_queue_size': (int, False),
+    'file_idle_time': (NUMBER, False),
+    'run_start_timeout': (NUMBER, False),
+    'run_stop_timeout': (NUMBER, False),
+    'journal_path': (str, False),
+    'calib_data': (str, False),
+    'pulser_inacitve_chans': (list, False),
+    'pulser_period': (NUMBER, False),
+    'pulser_duration': (NUMBER, False),
+    'default_voltage': (NUMBER, False),
+}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _app_path(path):
+    app_path = ''
+    for word in path.split('/'):
+        if word == REPOSITORY_NAME:
+            break
+        app_path += word
+        app_path += '/'
+    return app_path
+
+
+APP_PATH = _app_path(os.path.abspath(__file__))
+
 
 class Config:
     def __init__(self):
         self.path = os.path.abspath(__file__)
-        path_split = self.path.split('/')
-        self.app_path = ''
-        for word in path_split:
-            if word == REPOSITORY_NAME:
-                break
-            self.app_path += word
-            self.app_path += '/'
+        self.app_path = APP_PATH
 
     def config_path(self):
         self.path_to_config = self.app_path + CONFIG_PATH
         return self.path_to_config
 
     def parse_yaml(self):
-        with open(self.config_path(), "r") as stream:
-            self.data = yaml.safe_load(stream)
-            return self.data
+        """
+            Configuration of the process, parsed once by the shared ConfigService.
+            The returned dict is a copy, the caller may modify it.
+        """
+        self.data = dict(config_service(self.config_path()).data)
+        return self.data
+
+
+def validate(data):
+    """
+        Check `data` against SCHEMA, raise ConfigError listing every problem
+    """
+    if not isinstance(data, dict):
+        raise ConfigError("config.yaml does not contain a mapping")
+    errors = []
+    for key, (types, required) in SCHEMA.items():
+        if key not in data or data[key] is None:
+            if required:
+                errors.append(f"missing '{key}'")
+            continue
+        value = data[key]
+        # bool is an int subclass, do not accept it for numbers
+        if not isinstance(value, types) or (isinstance(value, bool) and types is not bool):
+            expected = ' or '.join(t.__name__ for t in (types if isinstance(types, tuple) else (types,)))
+            errors.append(f"'{key}' should be {expected}, got {value!r}")
+    if errors:
+        raise ConfigError("Invalid config.yaml: " + "; ".join(errors))
+    return data
+
+
+class ConfigService:
+    """
+        config.yaml parsed and validated once per process.
+
+        reload() parses the file again and swaps the whole dict at once, so a
+        reader never sees a half-updated configuration; an invalid file is
+        rejected and the previous configuration stays in use. watch() reloads
+        it whenever the file changes on disk. A reload reaches the code that
+        reads its values through the service; what a component copied when
+        it started (e.g. the number of file workers) needs a restart.
+    """
+    def __init__(self, path, logger=None):
+        self.path = os.path.abspath(path)
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.version = 0
+        self.loaded_at = None
+        self._data = None
+
+    @property
+    def data(self):
+        data = self._data
+        if data is None:
+            with self.lock:
+                if self._data is None:
+                    self._load()
+                data = self._data
+        return data
+
+    def _load(self):
+        with open(self.path, "r") as stream:
+            data = validate(yaml.safe_load(stream))
+        self._data = data
+        self.version += 1
+        self.loaded_at = datetime.now()
+
+    def reload(self):
+        """
+            Parse the file again, return True if the new configuration is in use
+        """
+        with self.lock:
+            try:
+                self._load()
+            except (OSError, yaml.YAMLError, ConfigError) as e:
+                self.logger.error(f"Config {self.path} not reloaded, keeping the previous one: {e}")
+                return False
+        self.logger.info(f"Config {self.path} reloaded (version {self.version})")
+        return True
+
+    def watch(self, observer, delay=RELOAD_DELAY):
+        """
+            Reload whenever the watchdog `observer` sees the file change. The
+            reload waits for `delay` s without events so a file still being
+            written is not parsed.
+        """
+        from watchdog.events import FileSystemEventHandler
+        service = self
+        timer = None
+        timer_lock = threading.Lock()
+
+        class ConfigFileHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                nonlocal timer
+                # Editors often write a temporary file then rename it over config.yaml
+                paths = (event.src_path, getattr(event, 'dest_path', ''))
+                if event.is_directory or service.path not in paths:
+                    return
+                if event.event_type not in ('modified', 'created', 'moved', 'closed'):
+                    return  # e.g. opened, by the reload itself
+                with timer_lock:
+                    if timer is not None:
+                        timer.cancel()
+                    timer = threading.Timer(delay, service.reload)
+                    timer.daemon = True
+                    timer.start()
+
+        observer.schedule(ConfigFileHandler(), os.path.dirname(self.path), recursive=False)
+
+    # Typed accessors
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def _typed(self, key, default, convert, name):
+        value = self.data.get(key)
+        if value is None:
+            return default
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            raise ConfigError(f"'{key}' = {value!r} is not a valid {name}")
+
+    def get_str(self, key, default=None):
+        return self._typed(key, default, str, 'string')
+
+    def get_int(self, key, default=None):
+        return self._typed(key, default, int, 'integer')
+
+    def get_float(self, key, default=None):
+        return self._typed(key, default, float, 'number')
+
+    def get_bool(self, key, default=None):
+        return self._typed(key, default, _to_bool, 'boolean')
+
+    def get_path(self, key, default=None):
+        return self._typed(key, default, Path, 'path')
+
+    def get_list(self, key, default=None):
+        return self._typed(key, default, list, 'list')
+
+    def require_str(self, key):
+        """
+            get_str of a key the caller cannot do without, ConfigError if it is not set
+        """
+        value = self.get_str(key)
+        if value is None:
+            raise ConfigError(f"'{key}' is not set in {self.path}")
+        return value
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        if value.lower() in ('true', 'yes', 'on', '1'):
+            return True
+        if value.lower() in ('false', 'no', 'off', '0'):
+            return False
+        raise ValueError(value)
+    return bool(value)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
 
+def config_service(path=None):
+    """
+        Shared ConfigService of `path` (config.yaml of the repository by default)
+    """
+    path = os.path.abspath(path or APP_PATH + CONFIG_PATH)
+    with _services_lock:
+        service = _services.get(path)
+        if service is None:
+            service = _services[path] = ConfigService(path)
+        return service
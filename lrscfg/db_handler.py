@@ -2,14 +2,14 @@ import sqlite3
 import csv
 import os
 from datetime import datetime
-from prettytable import PrettyTable
 from lrscfg.config import Config
 
 class DB_Handler:
     def __init__(self):
         config_settings = Config().parse_yaml()
         db_path = config_settings["db_path"]
-        self.conn = sqlite3.connect(db_path)
+        # The run control server writes to the same file, wait for its commits
+        self.conn = sqlite3.connect(db_path, timeout=30)
         self.cursor = self.conn.cursor()
 
         self.cursor.execute('''
@@ -194,6 +194,7 @@ class DB_Handler:
             return
         
         headers = [description[0] for description in self.cursor.description]
+        from prettytable import PrettyTable
         table = PrettyTable(headers)
         for config in configurations:
             table.add_row(config)
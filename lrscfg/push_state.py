@@ -0,0 +1,102 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from lrscfg.config import config_service
+
+DEFAULT_PUSH_STATE = 'lrscfg_push_state.json'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PushState:
+    """
+        sha256 of the config last applied to each device, to push only the
+        configs that changed.
+
+        {"sipm/acd-sipmpsctrl01.fnal.gov/22": "<sha256>", "vga/acd-vgactrl01": "<sha256>"}
+
+        A key is recorded only once its config was applied successfully and
+        forgotten when the device state is no longer known (ramp down,
+        supplr restart). The file is read again before every push, and every
+        change re-reads it under a file lock and only updates its own keys,
+        so the server and the lrscfg commands do not overwrite each other.
+    """
+    def __init__(self, path, logger=None):
+        self.path = str(path)
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.digests = {}
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            # Unknown state, everything is pushed again
+            self.logger.warning(f"Push state {self.path} unreadable, ignored: {e}")
+            return {}
+
+    def load(self):
+        with self.lock:
+            self.digests = self._read()
+        return self
+
+    def _update(self, change):
+        """
+            Apply change(digests) to the current content of the file, under an exclusive lock
+        """
+        with self.lock, open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            digests = self._read()
+            change(digests)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(digests, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+            self.digests = digests
+
+    def changed(self, key, digest):
+        with self.lock:
+            return self.digests.get(key) != digest
+
+    def record(self, key, digest):
+        self._update(lambda digests: digests.__setitem__(key, digest))
+
+    def forget(self, prefix=''):
+        """
+            Forget the keys starting with `prefix` (all by default)
+        """
+        def change(digests):
+            for key in [k for k in digests if k.startswith(prefix)]:
+                del digests[key]
+        self._update(change)
+
+
+_push_state = None
+_push_state_lock = threading.Lock()
+
+
+def get_push_state():
+    """
+        Shared PushState (push_state_path, default next to db_path), loaded from its file
+    """
+    global _push_state
+    config = config_service()
+    path = config.get_str("push_state_path") or \
+        os.path.join(os.path.dirname(config.require_str("db_path")), DEFAULT_PUSH_STATE)
+    with _push_state_lock:
+        if _push_state is None or _push_state.path != path:
+            _push_state = PushState(path)
+    return _push_state.load()
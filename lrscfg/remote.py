@@ -0,0 +1,235 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from lrscfg.config import config_service
+
+SSH_USER = 'pi'
+CONTROL_DIR = '/tmp/lrs-ssh'
+CONTROL_PERSIST = 600 # s the master connection stays open after the last command
+SSH_TIMEOUT = None # s per command, no limit by default
+SSH_RETRIES = 2
+RETRY_DELAY = 1 # s
+CONNECT_TIMEOUT = 10 # s
+SSH_ERROR = 255 # exit code of ssh itself (connection failed), not of the remote command
+LOCAL_ROOT = '/tmp/lrs-fake-pi'
+
+
+class SSHSession:
+    """
+        Commands and copies to one Raspberry Pi over a single multiplexed
+        OpenSSH connection.
+
+        The first command opens a background master connection (ControlMaster,
+        socket in `control_dir`) that stays up for `persist` s after the last
+        command, also across processes (e.g. successive lrscfg commands). The
+        following ssh/scp reuse it and skip the TCP and key exchange handshake.
+        Before each command the master is checked (ssh -O check) and opened
+        again if it died; ssh falls back to a direct connection if it cannot.
+
+        Only the connection failures (ssh exit code 255) are retried. A
+        failed or timed out command is not run again: killing the local ssh
+        does not stop the remote command, which may still be driving the bus.
+    """
+    def __init__(self, host, user=SSH_USER, control_dir=CONTROL_DIR, persist=CONTROL_PERSIST,
+                 timeout=SSH_TIMEOUT, retries=SSH_RETRIES, logger=None):
+        self.host = host
+        self.user = user
+        self.target = f"{user}@{host}" if user else host
+        self.control_dir = control_dir
+        self.control_path = os.path.join(control_dir, f"{self.target}:22")
+        self.persist = persist
+        self.timeout = timeout
+        self.retries = retries
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.stats = {"commands": 0, "failed": 0, "retries": 0, "masters": 0,
+                      "last_latency": None, "total_latency": 0.0}
+
+    def _options(self):
+        return ['-o', f'ControlPath={self.control_path}', '-o', 'ControlMaster=no',
+                '-o', f'ConnectTimeout={CONNECT_TIMEOUT}', '-o', 'BatchMode=yes']
+
+    def _master_alive(self):
+        if not os.path.exists(self.control_path):
+            return False
+        proc = subprocess.run(['ssh', '-o', f'ControlPath={self.control_path}', '-O', 'check', self.target],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              timeout=CONNECT_TIMEOUT)
+        if proc.returncode != 0:
+            # Stale socket of a dead master, it would disable the multiplexing
+            try:
+                os.unlink(self.control_path)
+            except FileNotFoundError:
+                pass
+            return False
+        return True
+
+    def _ensure_master(self):
+        with self.lock:
+            if self._master_alive():
+                return
+            os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+            start = time.monotonic()
+            # -f: backgrounds once connected. No pipes are handed to the master,
+            # it would keep them open and block the caller reading them.
+            proc = subprocess.run(
+                ['ssh', '-x', '-M', '-N', '-f', '-o', f'ControlPath={self.control_path}',
+                 '-o', f'ControlPersist={self.persist}', '-o', f'ConnectTimeout={CONNECT_TIMEOUT}',
+                 '-o', 'BatchMode=yes', self.target],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                timeout=CONNECT_TIMEOUT * 2)
+            if proc.returncode == 0:
+                self.stats["masters"] += 1
+                self.logger.debug(f"{self.host}: master connection opened in {(time.monotonic()-start)*1000:.0f} ms")
+            else:
+                self.logger.warning(f"{self.host}: master connection failed (exit code {proc.returncode}), "
+                                    "using direct connections")
+
+    def _ssh_argv(self, cmd):
+        return ['ssh', '-x', *self._options(), self.target, cmd]
+
+    def _run_kwargs(self):
+        return {}
+
+    def _scp_argv(self, src, dest):
+        return ['scp', '-q', *self._options(), src, f"{self.target}:{dest}"]
+
+    def _execute(self, argv, label, timeout, retries, check, capture):
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        output = dict(stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) if capture else {}
+        start = time.monotonic()
+        for attempt in range(retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                self.logger.warning(f"{self.host}: '{label}' failed to connect, retry {attempt}/{retries}")
+                time.sleep(RETRY_DELAY)
+            self._ensure_master()
+            try:
+                proc = subprocess.run(argv, stdin=subprocess.DEVNULL, timeout=timeout, **output, **self._run_kwargs())
+            except subprocess.TimeoutExpired:
+                self.stats["commands"] += 1
+                self.stats["failed"] += 1
+                self.logger.warning(f"{self.host}: '{label}' timed out after {timeout} s, not retried")
+                raise
+            if proc.returncode != SSH_ERROR:
+                break
+        latency = time.monotonic() - start
+        self.stats["commands"] += 1
+        self.stats["last_latency"] = latency
+        self.stats["total_latency"] += latency
+
+        if proc.returncode != 0:
+            self.stats["failed"] += 1
+        self.logger.debug(f"{self.host}: '{label}' exit code {proc.returncode} in {latency*1000:.0f} ms")
+        if check:
+            proc.check_returncode()
+        return proc
+
+    def run(self, cmd, timeout=None, retries=None, check=True, capture=False):
+        """
+            Run the shell command `cmd` on the Pi, return the CompletedProcess.
+            capture: return stdout and stderr (merged) as text instead of printing them
+        """
+        return self._execute(self._ssh_argv(cmd), cmd, timeout, retries, check, capture)
+
+    def copy(self, src, dest, timeout=None, retries=None, check=True):
+        """
+            Copy the local file `src` to `dest` on the Pi
+        """
+        return self._execute(self._scp_argv(src, dest), f"copy {src} to {dest}", timeout, retries, check, False)
+
+    def batch(self, commands, timeout=None, retries=None, check=True, capture=False):
+        """
+            Run `commands` one after the other in a single ssh command (same shell,
+            a cd applies to the next ones), stop at the first failure
+        """
+        return self.run(' && '.join(f'{{ {cmd}; }}' for cmd in commands), timeout, retries, check, capture)
+
+    def close(self):
+        """
+            Stop the master connection
+        """
+        with self.lock:
+            if os.path.exists(self.control_path):
+                subprocess.run(['ssh', '-o', f'ControlPath={self.control_path}', '-O', 'exit', self.target],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class LocalSession(SSHSession):
+    """
+        Stand-in running the commands and copies on this machine, selected
+        with ssh_transport: local to try the device steps without the Pis.
+
+        Each host gets a fake home directory <root>/<host>: the commands run
+        there with HOME pointing to it and <home>/bin first in PATH (where
+        stubs of supplr, configure.sh, ... can be put), and the remote paths
+        of the copies are mapped under it.
+    """
+    def __init__(self, host, root=LOCAL_ROOT, **kwargs):
+        super().__init__(host, **kwargs)
+        self.home = os.path.join(root, host)
+
+    def _ensure_master(self):
+        os.makedirs(self.home, exist_ok=True)
+
+    def _local_path(self, path):
+        if path == '~' or path.startswith('~/'):
+            path = path[2:]
+        return os.path.join(self.home, path.lstrip('/'))
+
+    def _ssh_argv(self, cmd):
+        return ['bash', '-c', cmd]
+
+    def _run_kwargs(self):
+        env = dict(os.environ, HOME=self.home, PATH=os.path.join(self.home, 'bin') + os.pathsep + os.environ.get('PATH', ''))
+        return {'cwd': self.home, 'env': env}
+
+    def _scp_argv(self, src, dest):
+        dest = self._local_path(dest)
+        os.makedirs(dest if dest.endswith('/') else os.path.dirname(dest), exist_ok=True)
+        return ['cp', src, dest]
+
+    def close(self):
+        pass
+
+
+TRANSPORTS = {'ssh': SSHSession, 'local': LocalSession}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host, user=SSH_USER, logger=None):
+    """
+        Shared session of `host`, configured from the ssh_* keys of config.yaml
+    """
+    with _sessions_lock:
+        session = _sessions.get((user, host))
+        if session is None:
+            config = config_service()
+            transport = config.get_str("ssh_transport", "ssh")
+            if transport not in TRANSPORTS:
+                raise ValueError(f"Unknown ssh_transport '{transport}', expected one of {', '.join(TRANSPORTS)}")
+            kwargs = {"root": config.get_str("ssh_local_root", LOCAL_ROOT)} if transport == 'local' else {}
+            session = _sessions[(user, host)] = TRANSPORTS[transport](
+                host, user=user, **kwargs,
+                control_dir=config.get_str("ssh_control_dir", CONTROL_DIR),
+                persist=config.get_int("ssh_persist", CONTROL_PERSIST),
+                timeout=config.get_float("ssh_timeout", SSH_TIMEOUT),
+                retries=config.get_int("ssh_retries", SSH_RETRIES),
+                logger=logger)
+        elif logger is not None:
+            session.logger = logger
+        return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
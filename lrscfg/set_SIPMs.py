@@ -1,17 +1,42 @@
 import pandas as pd
 import numpy as np
-import subprocess
 import csv
 import sys
 import os
 import time
+import threading
+import shlex
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-from lrscfg.config import Config
+from lrscfg.config import Config, config_service
+from lrscfg.remote import get_session
+from lrscfg.push_state import get_push_state, file_sha256
 
 WAIT_TIME = 3 # s
 WAIT_TRY = 10
 
-def restart_supplr(server, logger=None):
+CAN_FREE = "CAN status: Free"
+POLL_START = 0.2 # s, first interval of the can-status polling
+POLL_MAX = 2 * WAIT_TIME # s, the interval doubles up to this
+RESTART_AFTER = 3 * WAIT_TIME * WAIT_TRY # s not ready before supplr is restarted
+MONITOR_INTERVAL = 1 # s between two can-status reads of the background monitor
+MONITOR_READ_TIMEOUT = 10 # s, a can-status read of the monitor is abandoned after it
+STAGE_DIR = "LEDRuns" # staged calibration configs, in sipm_config_path_raspi
+
+# module: (supplr server, board). The two Raspberry Pis have their own CAN bus.
+SIPM_BOARDS = {
+    0: ('acd-sipmpsctrl01.fnal.gov', 22),
+    1: ('acd-sipmpsctrl01.fnal.gov', 21),
+    2: ('acd-sipmpsctrl23.fnal.gov', 11),
+    3: ('acd-sipmpsctrl23.fnal.gov', 13),
+}
+
+def restart_supplr(server, logger=None, wait=True):
+    """
+    wait: sleep until the service is up, else the caller polls its status
+    """
     if logger is None:
         print(f"Supplr server on {server} will restart")
     else:
@@ -20,8 +45,13 @@ def restart_supplr(server, logger=None):
     cmd_restartSupplr = "sudo systemctl restart supplr.service"
     # cmd_restartSupplr = "source /home/pi/restart_supplr.sh"
     
-    subprocess.run(['ssh', '-x', f"pi@{server}", cmd_restartSupplr], check=True)
-    time.sleep(3)
+    get_session(server, logger=logger).run(cmd_restartSupplr)
+    # The boards may not keep the last pushed voltages
+    get_push_state().forget(f"sipm/{server}/")
+    if _monitor is not None:
+        _monitor.invalidate(server)
+    if wait:
+        time.sleep(3)
 
     if logger is None:
         print(f"Supplr server on {server} was restarted")
@@ -30,42 +60,129 @@ def restart_supplr(server, logger=None):
 
     return 0
 
+def read_can_status(server, logger=None, timeout=None):
+    """
+        Output of supplr can-status (also when it fails, e.g. service restarting)
+    """
+    proc = get_session(server, logger=logger).run("supplr can-status", timeout=timeout, check=False, capture=True)
+    return proc.stdout.strip()
+
 def check_supplr_status(server, logger=None):
     """
-        Read the can status of supplr every WAIT_TIME sec until is it free
+        Wait until the can status of supplr is free. Returns at once if the
+        background monitor saw it free recently, else polls it with an
+        interval growing from POLL_START to POLL_MAX s; supplr is restarted
+        if not free after RESTART_AFTER s.
     """
-    cmd_checkSupplr = "supplr can-status"
+    if _monitor is not None and _monitor.is_free(server):
+        if logger is None:
+            print(f"supplr ready on {server}")
+        else:
+            logger.debug(f"supplr ready on {server} (monitor)")
+        return 0
+
+    interval = POLL_START
+    since = time.monotonic()
     i=0
     while True:
-        proc = subprocess.run(
-            ['ssh', '-x', f"pi@{server}", cmd_checkSupplr],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-        )
-        answ = proc.stdout.strip()
-        time.sleep(WAIT_TIME)
-        if answ != "CAN status: Free":
-            if logger is None:
-                print(f"Warning: supplr not ready on {server} ({i+1}/{WAIT_TRY}). Output: {answ}")
-            else:
-                logger.debug(f"Warning: supplr not ready on {server}. Output: {answ}")
-
-            if i >= WAIT_TRY-1:
-                restart_supplr(server, logger)
-
-            time.sleep(WAIT_TIME*2)       
-        else:
+        answ = read_can_status(server, logger=logger)
+        if answ == CAN_FREE:
             if logger is None:
                 print(f"supplr ready on {server}")
             else:
-                logger.debug(f"supplr ready on {server}")
-            
+                logger.debug(f"supplr ready on {server} after {time.monotonic() - since:.1f} s")
             return 0
 
+        if logger is None:
+            print(f"Warning: supplr not ready on {server} ({i+1}). Output: {answ}")
+        else:
+            logger.debug(f"Warning: supplr not ready on {server}. Output: {answ}")
+
+        if time.monotonic() - since >= RESTART_AFTER:
+            restart_supplr(server, logger, wait=False)
+            interval = POLL_START
+            since = time.monotonic()
+
+        time.sleep(interval)
+        interval = min(interval * 2, POLL_MAX)
         i += 1
 
+class SupplrMonitor:
+    """
+        Background thread reading the can status of the supplr servers every
+        `interval` s, so check_supplr_status does not wait when the bus is
+        already free. A status is used only if it was read less than two
+        intervals ago and after the last command sent to the bus of that
+        server (invalidate()). It only runs while set_SIPM pushes configs,
+        not while the DAQ takes data.
+    """
+    def __init__(self, servers, interval=MONITOR_INTERVAL, logger=None):
+        self.servers = list(servers)
+        self.interval = interval
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.status = {}  # server: (output, time the read started)
+        self.invalidated = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='supplr-monitor', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=MONITOR_READ_TIMEOUT):
+        self.stop_event.set()
+        self.thread.join(timeout)
+        if self.thread.is_alive() and self.logger is not None:
+            self.logger.warning(f"supplr monitor still reading after {timeout} s, left to finish")
+
+    def invalidate(self, server):
+        with self.lock:
+            self.invalidated[server] = time.monotonic()
+
+    def is_free(self, server):
+        with self.lock:
+            answ, read_at = self.status.get(server, (None, 0))
+            return (answ == CAN_FREE and read_at > self.invalidated.get(server, 0)
+                    and time.monotonic() - read_at < 2 * self.interval)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            for server in self.servers:
+                read_at = time.monotonic()
+                try:
+                    answ = read_can_status(server, logger=self.logger, timeout=MONITOR_READ_TIMEOUT)
+                except Exception as e:
+                    answ = None
+                    if self.logger is not None:
+                        self.logger.debug(f"supplr monitor: can status of {server} not read: {e}")
+                with self.lock:
+                    self.status[server] = (answ, read_at)
+                if self.stop_event.is_set():
+                    return
+            self.stop_event.wait(self.interval)
+
+_monitor = None
+
+def start_supplr_monitor(logger=None):
+    """
+        Start the background can status monitor of the SiPM supplr servers
+        (supplr_monitor_interval s, 0 to disable), return it or None
+    """
+    global _monitor
+    interval = config_service().get_float("supplr_monitor_interval", MONITOR_INTERVAL)
+    if _monitor is not None or not interval:
+        return _monitor
+    servers = sorted({server for server, board in SIPM_BOARDS.values()})
+    _monitor = SupplrMonitor(servers, interval, logger=logger).start()
+    return _monitor
+
+def stop_supplr_monitor():
+    global _monitor
+    monitor, _monitor = _monitor, None
+    if monitor is not None:
+        monitor.stop()
+
 def stop_SiPMmoniotoring(logger=None):
      
     if logger is None:
@@ -74,8 +191,8 @@ def stop_SiPMmoniotoring(logger=None):
         logger.debug("Stopping SiPM bias voltage monitoring")
 
     stop_cmd = "screen -S Bias -X quit"
-    subprocess.run(['ssh', '-x','pi@acd-sipmpsctrl01.fnal.gov', stop_cmd])
-    subprocess.run(['ssh', '-x','pi@acd-sipmpsctrl23.fnal.gov', stop_cmd])
+    get_session('acd-sipmpsctrl01.fnal.gov', logger=logger).run(stop_cmd, check=False)
+    get_session('acd-sipmpsctrl23.fnal.gov', logger=logger).run(stop_cmd, check=False)
     time.sleep(WAIT_TIME)
 
     return 0
@@ -88,83 +205,241 @@ def start_SiPMmoniotoring(logger=None):
         logger.debug("Starting SiPM bias voltage monitoring")
 
     start_cmd = "source ~/start_bias_V_in_screen.sh"
-    subprocess.run(['ssh', '-x','pi@acd-sipmpsctrl01.fnal.gov', start_cmd])
-    subprocess.run(['ssh', '-x','pi@acd-sipmpsctrl23.fnal.gov', start_cmd])
+    get_session('acd-sipmpsctrl01.fnal.gov', logger=logger).run(start_cmd, check=False)
+    get_session('acd-sipmpsctrl23.fnal.gov', logger=logger).run(start_cmd, check=False)
     time.sleep(WAIT_TIME)
 
     return 0
 
-def set_SIPM(config_folder=None, manage_monitoring=True, logger=None):
+def on_servers(work, what, logger=None):
     """
-    config_folder: config folder path
+        Run work[server] = (func, *args) for all the servers at the same time.
+        Once all are done, log the failures and raise the first one.
     """
-    config = Config().parse_yaml()
-    if config_folder is None:
-        config_folder = os.path.join(config["sipm_config_path"], "tmp/")
+    with ThreadPoolExecutor(max_workers=len(work), thread_name_prefix='supplr') as executor:
+        futures = {server: executor.submit(*task) for server, task in work.items()}
+    for server, future in futures.items():
+        error = future.exception()
+        if error is not None:
+            if logger is None:
+                print(f"Error: {what} failed on {server}: {error}")
+            else:
+                logger.error(f"{what} failed on {server}: {error}")
+    return {server: future.result() for server, future in futures.items()}
 
-    if manage_monitoring == False:
-        if logger is None:
-            print("Warning: Monitoring state unchanged. Please check, an active monitoring session may cause network overload.")
-        else:
-            logger.warning("Warning: Monitoring state unchanged. Please check, an active monitoring session may cause network overload.")
-    
-    # N_modules = 4
-    modules = [0, 2, 1, 3] # Alternate supplr to minimize the chance of error
+# Configs staged by stage_SIPM_configs: local root, remote root, {relative path: (size, mtime_ns)}, servers
+_staged = None
 
-    if manage_monitoring == True:
-        stop_SiPMmoniotoring()
+def staged_path(server, config_file):
+    """
+        Path on `server` of the staged copy of the local `config_file`, None
+        if it was not staged there or changed since
+    """
+    staged = _staged
+    if staged is None or server not in staged["servers"]:
+        return None
+    rel = os.path.relpath(os.path.abspath(config_file), staged["local"])
+    try:
+        st = os.stat(config_file)
+    except OSError:
+        return None
+    if staged["files"].get(rel) != (st.st_size, st.st_mtime_ns):
+        return None
+    return os.path.join(staged["remote"], rel)
 
+def stage_host(server, archive, archive_hash, config_folder_raspi, logger=None):
+    """
+        Copy the archive to `server`, check its sha256, unpack it next to
+        the previous staged tree, check every file against SHA256SUMS and
+        only then replace the previous tree
+    """
+    session = get_session(server, logger=logger)
+    name = f"{STAGE_DIR}.tar.gz"
+    raspi_dir = shlex.quote(config_folder_raspi)
+    new = shlex.quote(STAGE_DIR + ".new")
+    session.run(f"mkdir -p {raspi_dir}")
+    session.copy(archive, os.path.join(config_folder_raspi, name))
+    session.batch([
+        f"cd {raspi_dir}",
+        f"echo '{archive_hash}  {name}' | sha256sum -c --quiet",
+        f"rm -rf {new} && mkdir {new} && tar -xzf {name} -C {new}",
+        f"(cd {new} && sha256sum -c --quiet SHA256SUMS)",
+        f"rm -rf {STAGE_DIR} && mv {new} {STAGE_DIR} && rm -f {name}",
+    ])
 
-    # for n_mod in range(N_modules):
-    for n_mod in modules:
+def stage_SIPM_configs(config_folders, logger=None):
+    """
+        Ship all the calibration config folders (LEDRuns/<n>/MODx.csv) to the
+        supplr servers at once, as one archive with checksums. The following
+        set_SIPM calls on these folders only run set-channel-file on the
+        staged files. Returns False (per-subrun copies) if it failed.
+    """
+    global _staged
+    _staged = None
+    if not config_folders:
+        return False
+    config_folder_raspi = Config().parse_yaml()["sipm_config_path_raspi"]
+    local = os.path.commonpath([os.path.abspath(f) for f in config_folders])
+    if len(config_folders) == 1:
+        local = os.path.dirname(local)
 
-        if logger is None:
-            print(f"Configuring SiPM bias voltage of module {n_mod}")
-        else:
-            logger.debug(f"Configuring SiPM bias voltage of module {n_mod}")
-
-        config_file = os.path.join(config_folder, f"MOD{n_mod}.csv")
-        config_folder_raspi = config["sipm_config_path_raspi"]
-        
-        server = ''
-        board = 0
-        if n_mod in [0,1]:
-            server = 'acd-sipmpsctrl01.fnal.gov'
-            if n_mod == 0:
-                board = 22
-            else:
-                board = 21
-        elif n_mod in [2,3]:
-            server = 'acd-sipmpsctrl23.fnal.gov'
-            if n_mod == 2:
-                board = 11
+    files = {}
+    sums = []
+    for folder in config_folders:
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(os.path.abspath(folder), name)
+            rel = os.path.relpath(path, local)
+            st = os.stat(path)
+            files[rel] = (st.st_size, st.st_mtime_ns)
+            sums.append(f"{file_sha256(path)}  {rel}\n")
+
+    servers = sorted({server for server, board in SIPM_BOARDS.values()})
+    start = time.monotonic()
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "SHA256SUMS"), 'w') as f:
+            f.writelines(sums)
+        archive = os.path.join(tmp, f"{STAGE_DIR}.tar.gz")
+        with tarfile.open(archive, "w:gz") as tar:
+            tar.add(os.path.join(tmp, "SHA256SUMS"), arcname="SHA256SUMS")
+            for rel in files:
+                tar.add(os.path.join(local, rel), arcname=rel)
+        archive_hash = file_sha256(archive)
+        try:
+            on_servers({server: (stage_host, server, archive, archive_hash, config_folder_raspi, logger)
+                        for server in servers}, "Staging of the SiPM configs", logger=logger)
+        except Exception as e:
+            if logger is None:
+                print(f"Warning: SiPM configs not staged, they will be copied for each subrun: {e}")
             else:
-                board = 13
+                logger.warning(f"SiPM configs not staged, they will be copied for each subrun: {e}")
+            return False
+
+    _staged = {"local": local, "remote": os.path.join(config_folder_raspi, STAGE_DIR),
+               "files": files, "servers": set(servers)}
+    if logger is None:
+        print(f"{len(files)} SiPM config files staged on {', '.join(servers)}")
+    else:
+        logger.debug(f"{len(files)} SiPM config files staged on {', '.join(servers)} in {time.monotonic() - start:.1f} s")
+    return True
 
+def sipm_key(n_mod):
+    server, board = SIPM_BOARDS[n_mod]
+    return f"sipm/{server}/{board}"
+
+def set_module(n_mod, config_folder, config_folder_raspi, logger=None, state=None):
+    """
+        Copy MOD<n_mod>.csv to its supplr server and apply it
+        state: PushState recording the applied config
+    """
+    if logger is None:
+        print(f"Configuring SiPM bias voltage of module {n_mod}")
+    else:
+        logger.debug(f"Configuring SiPM bias voltage of module {n_mod}")
+
+    config_file = os.path.join(config_folder, f"MOD{n_mod}.csv")
+    digest = file_sha256(config_file)
+    server, board = SIPM_BOARDS[n_mod]
+    session = get_session(server, logger=logger)
+    config_file_raspi = staged_path(server, config_file)
+    copied = True
+
+    if config_file_raspi is None:
         # Copy the config file on the raspi
-        
-        subprocess.run(['scp', config_file, f'pi@{server}:{config_folder_raspi}'])
-        if logger is None:
+        config_file_raspi = os.path.join(config_folder_raspi, f"MOD{n_mod}.csv")
+        copied = session.copy(config_file, config_file_raspi, check=False).returncode == 0
+        if not copied:
+            if logger is None:
+                print(f"Warning: config file not copied to {server}:{config_folder_raspi}")
+            else:
+                logger.warning(f"Config file not copied to {server}:{config_folder_raspi}")
+        elif logger is None:
             print(f"Config files copied to {server}:{config_folder_raspi}")
         else:
             logger.debug(f"Config files copied to {server}:{config_folder_raspi}")
-        time.sleep(WAIT_TIME)
 
-        # Check if supplr ready and capture its output (stdout+stderr) as text
-        check_supplr_status(server, logger=logger)
+    # Check if supplr ready and capture its output (stdout+stderr) as text
+    check_supplr_status(server, logger=logger)
 
-        # Set the SiPM bias voltage
-        config_file_raspi = os.path.join(config_folder_raspi, f"MOD{n_mod}.csv")
-        cmd_setSiPM = f"supplr set-channel-file --board {board} --file {config_file_raspi}"
-        subprocess.run(['ssh', '-x', f"pi@{server}", cmd_setSiPM], check=True)
+    # Set the SiPM bias voltage
+    cmd_setSiPM = f"supplr set-channel-file --board {board} --file {config_file_raspi}"
+    # A status read before the end of the command must not be used for the next module
+    if _monitor is not None:
+        _monitor.invalidate(server)
+    try:
+        session.run(cmd_setSiPM)
+    finally:
+        if _monitor is not None:
+            _monitor.invalidate(server)
+    # A failed copy applied the previous csv left on the Pi, not this one
+    if state is not None and copied:
+        state.record(sipm_key(n_mod), digest)
+    elif state is not None:
+        state.forget(sipm_key(n_mod))
 
+    if logger is None:
+        print(f"SiPM bias voltage of module {n_mod} configured")
+    else:
+        logger.debug(f"SiPM bias voltage of module {n_mod} configured")
+
+def set_host_modules(modules, config_folder, config_folder_raspi, logger=None, state=None):
+    """
+        Configure the modules of one supplr server one after the other (shared CAN bus)
+    """
+    for n_mod in modules:
+        set_module(n_mod, config_folder, config_folder_raspi, logger=logger, state=state)
+
+def set_SIPM(config_folder=None, manage_monitoring=True, logger=None, parallel=None, force=False):
+    """
+    config_folder: config folder path
+    parallel: configure the two supplr servers at the same time (default: sipm_parallel, True)
+    force: push all the modules, also those whose config did not change since they were last applied
+    """
+    config = Config().parse_yaml()
+    if config_folder is None:
+        config_folder = os.path.join(config["sipm_config_path"], "tmp/")
+    if parallel is None:
+        parallel = config.get("sipm_parallel", True)
+    config_folder_raspi = config["sipm_config_path_raspi"]
+
+    state = get_push_state()
+    changed = [n_mod for n_mod in sorted(SIPM_BOARDS)
+               if force or state.changed(sipm_key(n_mod), file_sha256(os.path.join(config_folder, f"MOD{n_mod}.csv")))]
+    unchanged = sorted(set(SIPM_BOARDS) - set(changed))
+    if unchanged:
+        if logger is None:
+            print(f"SiPM bias voltage of modules {unchanged} unchanged, not pushed")
+        else:
+            logger.debug(f"SiPM bias voltage of modules {unchanged} unchanged, not pushed")
+    if not changed:
+        return
+
+    if manage_monitoring == False:
         if logger is None:
-            print(f"SiPM bias voltage of module {n_mod} configured")
+            print("Warning: Monitoring state unchanged. Please check, an active monitoring session may cause network overload.")
         else:
-            logger.debug(f"SiPM bias voltage of module {n_mod} configured")
+            logger.warning("Warning: Monitoring state unchanged. Please check, an active monitoring session may cause network overload.")
+
+    if manage_monitoring == True:
+        stop_SiPMmoniotoring()
 
-        # if n_mod in [0,2]:     # not necessary anymore, the modules alternate now
-        #     time.sleep(WAIT_TIME)
+    # The can status monitor runs only while the configs are pushed
+    own_monitor = _monitor is None
+    start_supplr_monitor(logger=logger)
+    try:
+        if parallel:
+            # One worker per server, each server keeps its modules in order
+            hosts = {}
+            for n_mod in changed:
+                hosts.setdefault(SIPM_BOARDS[n_mod][0], []).append(n_mod)
+            on_servers({server: (set_host_modules, modules, config_folder, config_folder_raspi, logger, state)
+                        for server, modules in hosts.items()},
+                       "SiPM bias voltage configuration", logger=logger)
+        else:
+            modules = [n_mod for n_mod in [0, 2, 1, 3] if n_mod in changed] # Alternate supplr to minimize the chance of error
+            set_host_modules(modules, config_folder, config_folder_raspi, logger=logger, state=state)
+    finally:
+        if own_monitor:
+            stop_supplr_monitor()
 
     if manage_monitoring == True:
             start_SiPMmoniotoring(logger=logger)
@@ -172,5 +447,6 @@ def set_SIPM(config_folder=None, manage_monitoring=True, logger=None):
     
 def set_SIPM_zero():
     print("Ramp down SiPM bias")
-    subprocess.run(['ssh', '-x', 'pi@acd-sipmpsctrl01', '.', '~/set0.sh'])
-    subprocess.run(['ssh', '-x', 'pi@acd-sipmpsctrl23', '.', '~/set0.sh'])
+    get_push_state().forget("sipm/")
+    get_session('acd-sipmpsctrl01').run('. ~/set0.sh', check=False)
+    get_session('acd-sipmpsctrl23').run('. ~/set0.sh', check=False)
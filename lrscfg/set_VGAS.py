@@ -1,20 +1,39 @@
 import pandas as pd
 import numpy as np
-import subprocess
 import csv
 import sys
 import os
 
 from lrscfg.config import Config
+from lrscfg.remote import get_session
+from lrscfg.push_state import get_push_state, file_sha256
 
-def set_VGA():
-    file_01 = Config().parse_yaml()["vga_config_path"] + "tmp/01.yaml"
-    file_23 = Config().parse_yaml()["vga_config_path"] + "tmp/23.yaml"
+VGA_HOSTS = {'acd-vgactrl01': '01', 'acd-vgactrl23': '23'}
+
+def set_VGA(force=False):
+    """
+    force: push the configs of all the hosts, also those that did not change since they were last applied
+    """
+    vga_config_path = Config().parse_yaml()["vga_config_path"]
+    state = get_push_state()
+
+    # host: (session, config file, sha256) of the configs to push
+    changed = {}
+    for host, name in VGA_HOSTS.items():
+        config_file = vga_config_path + f"tmp/{name}.yaml"
+        digest = file_sha256(config_file)
+        if force or state.changed(f"vga/{host}", digest):
+            changed[host] = (get_session(host), config_file, digest)
+        else:
+            print(f"VGA gain config of {host} unchanged, not pushed")
+    if not changed:
+        return
 
     print("Copy VGA gain configs")
-    subprocess.run(['scp', file_01, 'pi@acd-vgactrl01:~/soft/gainr/'])
-    subprocess.run(['scp', file_23, 'pi@acd-vgactrl23:~/soft/gainr/'])
+    copied = {host: session.copy(config_file, '~/soft/gainr/', check=False).returncode == 0
+              for host, (session, config_file, digest) in changed.items()}
     print("Set VGA gain configs")
-    subprocess.run(['ssh','pi@acd-vgactrl01', '.', '~/configure.sh'])
-    subprocess.run(['ssh','pi@acd-vgactrl23', '.', '~/configure.sh'])
+    for host, (session, config_file, digest) in changed.items():
+        if session.run('. ~/configure.sh', check=False).returncode == 0 and copied[host]:
+            state.record(f"vga/{host}", digest)
     print("VGA gain set!")
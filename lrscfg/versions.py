@@ -0,0 +1,122 @@
+import glob
+import os
+import re
+import sqlite3
+import threading
+
+from lrscfg.config import config_service
+
+ACTIVE_QUERIES = {
+    'MOAS': 'SELECT version FROM moas_versions WHERE is_active = 1',
+    'FOAS': 'SELECT version FROM foas_versions WHERE is_active = 1',
+}
+
+
+class VersionResolver:
+    """
+        Cached active and latest MOAS/FOAS versions.
+
+        The active versions are read once from the database and read again
+        only when another connection committed (PRAGMA data_version changed)
+        or after invalidate(). The latest versions are found by scanning the
+        csv directory only when its mtime changed (a csv was added or removed).
+    """
+    def __init__(self, db_path, moas_path, foas_path):
+        self.db_path = db_path
+        self.paths = {'MOAS': moas_path, 'FOAS': foas_path}
+        self.lock = threading.Lock()
+        self.conn = None
+        self._data_version = None
+        self._active = {}
+        self._latest = {}  # kind: (directory mtime, version)
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, timeout=30,
+                                        check_same_thread=False)
+        return self.conn
+
+    def invalidate(self):
+        with self.lock:
+            self._active = {}
+            self._latest = {}
+
+    def _active_version(self, kind):
+        with self.lock:
+            try:
+                conn = self._connect()
+                data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if data_version != self._data_version:
+                    self._active = {}
+                    self._data_version = data_version
+                if kind not in self._active:
+                    row = conn.execute(ACTIVE_QUERIES[kind]).fetchone()
+                    self._active[kind] = row[0] if row else None
+            except sqlite3.Error:
+                # No database or table yet, try again next time
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+                return None
+            return self._active[kind]
+
+    def _latest_version(self, kind):
+        path = self.paths[kind]
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except (FileNotFoundError, TypeError):
+            return None
+        with self.lock:
+            cached = self._latest.get(kind)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        files = glob.glob(path + f"{kind}_*.csv")
+        version = None
+        if files:
+            latest_file = os.path.basename(max(files, key=os.path.getmtime))
+            match = re.search(rf"{kind}_(\d{{8}}_\d{{6}})\.csv", latest_file)
+            if match:
+                version = match.group(1)
+        with self.lock:
+            self._latest[kind] = (mtime, version)
+        return version
+
+    def active_moas(self):
+        """
+            Active MOAS file name (MOAS_<version>.csv) or None
+        """
+        version = self._active_version('MOAS')
+        return f"MOAS_{version}.csv" if version else None
+
+    def active_foas(self):
+        version = self._active_version('FOAS')
+        return f"FOAS_{version}.csv" if version else None
+
+    def latest_moas(self):
+        """
+            Version (YYYYmmdd_HHMMSS) of the newest MOAS csv or None
+        """
+        return self._latest_version('MOAS')
+
+    def latest_foas(self):
+        return self._latest_version('FOAS')
+
+
+_resolver = None
+_resolver_config = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """
+        Shared VersionResolver, rebuilt when the configuration is reloaded
+    """
+    global _resolver, _resolver_config
+    config = config_service()
+    config.data  # loaded before its version is compared
+    with _resolver_lock:
+        if _resolver is None or _resolver_config != config.version:
+            _resolver = VersionResolver(config.require_str("db_path"), config.get_str("moas_path"),
+                                        config.get_str("foas_path"))
+            _resolver_config = config.version
+        return _resolver
@@ -0,0 +1,161 @@
+import json
+import os
+import sqlite3
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import click
+
+from lrscfg.config import Config
+from lrsctrl.metadata import write_metadata_files
+from lrsctrl.db_writer import RunsDBWriter
+
+DEFAULT_STATE_FILE = 'backfill_state.jsonl'
+
+
+def catalogued_files(db_path):
+    """
+        Names of the files already in lrs_runs_data
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        return {row[0] for row in conn.execute('SELECT DISTINCT filename FROM lrs_runs_data')}
+    except sqlite3.OperationalError:
+        return set()  # no table yet
+    finally:
+        conn.close()
+
+
+def find_missing(roots, db_path, min_age=600):
+    """
+        List the .data files under `roots` ({directory: data_stream}) without
+        a .data.json sidecar or a lrs_runs_data row. Files modified less than
+        `min_age` s ago may still be written by the DAQ and are skipped.
+        Return a list of (path, data_stream, needs_sidecar, needs_row).
+    """
+    in_db = catalogued_files(db_path)
+    now = time.time()
+    missing = []
+    for root, data_stream in roots.items():
+        for dirpath, _, filenames in os.walk(root):
+            for name in sorted(filenames):
+                if not name.endswith('.data'):
+                    continue
+                path = os.path.join(dirpath, name)
+                if now - os.path.getmtime(path) < min_age:
+                    continue
+                needs_sidecar = not os.path.exists(path + '.json')
+                needs_row = name not in in_db
+                if needs_sidecar or needs_row:
+                    missing.append((path, data_stream, needs_sidecar, needs_row))
+    return missing
+
+
+def _process(task):
+    """
+        Worker: build the sidecars of one file if needed and return its
+        metadata and scan cache rows. The database rows are written by the
+        parent process.
+    """
+    path, args, needs_sidecar = task
+    cache_rows = []
+    try:
+        if needs_sidecar:
+            meta = write_metadata_files(None, args, cache_rows=cache_rows)
+        else:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+        return path, meta, cache_rows, None
+    except Exception as e:
+        return path, None, [], f"{type(e).__name__}: {e}"
+
+
+def read_state(state_file):
+    """
+        Files already handled by a previous (interrupted) backfill
+    """
+    done = set()
+    if not os.path.exists(state_file):
+        return done
+    with open(state_file) as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['path'])
+            except (ValueError, KeyError):
+                pass  # partial last line of an interrupted run
+    return done
+
+
+def backfill(workers=4, dry_run=False, resume=False, state_file=None, min_age=600,
+             data_stream='commissioning', run_start_instance='lrsctrl'):
+    config = Config().parse_yaml()
+    db_path = config['db_path']
+    roots = {config['data_path']: data_stream}
+    if config.get('calib_data'):
+        roots.setdefault(config['calib_data'], 'calibration')
+    if state_file is None:
+        state_file = os.path.join(os.path.dirname(db_path), DEFAULT_STATE_FILE)
+
+    missing = find_missing(roots, db_path, min_age=min_age)
+    if resume:
+        done = read_state(state_file)
+        missing = [m for m in missing if m[0] not in done]
+    click.echo(f"{len(missing)} files to backfill")
+
+    if dry_run:
+        for path, stream, needs_sidecar, needs_row in missing:
+            todo = [w for w, n in (('sidecar', needs_sidecar), ('db row', needs_row)) if n]
+            click.echo(f"  {path} [{stream}]: {', '.join(todo)}")
+        return missing
+
+    needs_row = {m[0]: m[3] for m in missing}
+    tasks = []
+    for path, stream, needs_sidecar, _ in missing:
+        args = {
+            'datafile': path,
+            'database': db_path,
+            'data_stream': stream,
+            'run_starting_instance': run_start_instance,
+            'run': None,
+            'subrun': None,
+        }
+        tasks.append((path, args, needs_sidecar))
+    task_args = {t[0]: t[1] for t in tasks}
+
+    failed = 0
+    pending = []
+
+    def record(path, error):
+        nonlocal failed
+        if error is not None:
+            failed += 1
+        state.write(json.dumps({'path': path, 'error': error}) + '\n')
+        state.flush()
+
+    def record_committed(block=False):
+        # A file is done once its row is committed
+        for path, future in list(pending):
+            if block or future.done():
+                e = future.exception()
+                record(path, None if e is None else f"{type(e).__name__}: {e}")
+                pending.remove((path, future))
+
+    # The sidecars are built in parallel, the database is written from here only
+    with open(state_file, 'a' if resume else 'w') as state, \
+            Pool(processes=workers) as pool, RunsDBWriter(db_path) as writer:
+        results = pool.imap_unordered(_process, tasks)
+        with click.progressbar(results, length=len(tasks), label='Backfill',
+                               item_show_func=lambda r: Path(r[0]).name if r else '') as bar:
+            for path, meta, cache_rows, error in bar:
+                if error is None and (needs_row[path] or cache_rows):
+                    row_meta = meta if needs_row[path] else None
+                    pending.append((path, writer.submit(row_meta, task_args[path], cache_rows)))
+                else:
+                    record(path, error)
+                record_committed()
+        writer.close()
+        record_committed(block=True)
+
+    click.echo(f"Backfill done: {len(tasks) - failed} files processed, {failed} failed (see {state_file})")
+    return missing
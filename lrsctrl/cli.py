@@ -1,6 +1,7 @@
+import json
+
 import click
 from lrsctrl.client import Client
-from lrsctrl import server
 
 
 @click.group()
@@ -22,13 +23,73 @@ def stop_data_run():
 
 #Calibration run controls
 @lrsctrl.command()
-def start_calib_run():
-    Client().start_calib_run()
+@click.option("--follow", "-f", is_flag=True, help="Print the run log until it is finished")
+def start_calib_run(follow):
+    cl = Client()
+    job_id = cl.start_calib_run()
+    if follow and job_id:
+        cl.follow_job(job_id)
 
 #Pulser scan run controls
 @lrsctrl.command()
-def start_pulser_scan():
-    Client().start_pulser_scan()
+@click.option("--follow", "-f", is_flag=True, help="Print the run log until it is finished")
+def start_pulser_scan(follow):
+    cl = Client()
+    job_id = cl.start_pulser_scan()
+    if follow and job_id:
+        cl.follow_job(job_id)
+
+#Background jobs
+@lrsctrl.group()
+def jobs():
+    """Status of the calibration runs and pulser scans"""
+    pass
+
+def print_job(job):
+    eta = f'{job["eta"]:.0f} s' if job["eta"] is not None else '-'
+    progress = f'{job["current"]}/{job["total"]}' if job["total"] else '-'
+    print(f'{job["id"]}  {job["kind"]:<12} {job["state"]:<10} subrun {progress:<8} elapsed {job["elapsed"]:.0f} s  ETA {eta}'
+          + (f'  error: {job["error"]}' if job["error"] else ''))
+
+@jobs.command("list")
+def jobs_list():
+    for job in Client().list_jobs() or []:
+        print_job(job)
+
+@jobs.command("status")
+@click.argument("job_id")
+@click.option("--follow", "-f", is_flag=True, help="Print the job log until it is finished")
+def jobs_status(job_id, follow):
+    cl = Client()
+    if follow:
+        cl.follow_job(job_id)
+    elif job := cl.get_job(job_id):
+        print_job(job)
+
+@jobs.command("log")
+@click.argument("job_id")
+@click.option("--lines", "-n", default=50, show_default=True, type=int, help="Number of lines")
+def jobs_log(job_id, lines):
+    for entry in (Client().get_job_log(job_id) or [])[-lines:]:
+        print(entry["line"])
+
+@jobs.command("cancel")
+@click.argument("job_id")
+def jobs_cancel(job_id):
+    """Stop the job at the next subrun boundary"""
+    if job := Client().cancel_job(job_id):
+        print_job(job)
+
+
+#Live events
+@lrsctrl.command()
+@click.option("--type", "-t", "types", multiple=True, help="Event type or prefix (run, subrun, file, file.catalogued...)")
+def events(types):
+    """Print the run and file events as they happen"""
+    from datetime import datetime
+    for event in Client().stream_events(types):
+        data = " ".join(f"{k}={v}" for k, v in event["data"].items() if v is not None)
+        print(f'{datetime.fromtimestamp(event["time"]):%H:%M:%S.%f} {event["type"]:<16} {data}')
 
 
 #Test Calibration run controls
@@ -36,6 +97,66 @@ def start_pulser_scan():
 def start_test():
     Client().start_test()
 
+#Run catalog queries
+def print_table(items, columns=None):
+    from prettytable import PrettyTable
+    if not items:
+        print("No entries found.")
+        return
+    columns = columns or list(items[0].keys())
+    table = PrettyTable(columns)
+    for item in items:
+        table.add_row([item.get(c) for c in columns])
+    print(table)
+
+def catalog_options(func):
+    for option in reversed([
+        click.option("--run", "-r", type=int, default=None, help="MORCS run number"),
+        click.option("--filename", "-f", type=str, default=None, help="File name, wildcards * and ? allowed"),
+        click.option("--start", type=int, default=None, help="Only files ending after this unix time"),
+        click.option("--end", type=int, default=None, help="Only files starting before this unix time"),
+        click.option("--moas", type=str, default=None, help="Active MOAS file name"),
+        click.option("--data_stream", "-d", type=str, default=None, help="Data stream (run mode)"),
+        click.option("--limit", "-n", type=int, default=50, show_default=True, help="Number of entries"),
+        click.option("--offset", type=int, default=0, show_default=True, help="Entries to skip (pagination)"),
+    ]):
+        func = option(func)
+    return func
+
+@lrsctrl.group()
+def runs():
+    """Query the catalog of recorded runs and files"""
+    pass
+
+@runs.command("list")
+@catalog_options
+@click.option("--by-subrun", is_flag=True, help="One entry per run and subrun")
+def runs_list(by_subrun, **filters):
+    """Summary per run: number of files, size, start/end, TAI range"""
+    result = Client().get_runs(by_subrun=by_subrun, **filters)
+    if result is not None:
+        print_table(result["items"])
+
+@runs.command("show")
+@click.argument("run", type=int)
+@click.option("--afi", is_flag=True, help="Also print the AFI JSONs the run was recorded with")
+def runs_show(run, afi):
+    """Summary of RUN and of each of its subruns"""
+    result = Client().get_run(run, afi=afi)
+    if result is not None:
+        print_table([result["run"]])
+        print_table(result["items"])
+        if afi:
+            print(json.dumps(result["afi"], indent=1))
+
+@runs.command("files")
+@catalog_options
+def runs_files(**filters):
+    """List the files of the catalog"""
+    result = Client().get_run_files(**filters)
+    if result is not None:
+        print_table(result["items"])
+
 #####
 # NOT USED ANYMORE:
 #####
@@ -56,3 +177,19 @@ def start_rc():
 @lrsctrl.command()
 def stop_rc():
     Client().send_stop_rc()
+
+
+#Metadata backfill
+@lrsctrl.command()
+@click.option("--workers", "-j", default=4, show_default=True, type=int, help="Number of worker processes")
+@click.option("--dry-run", is_flag=True, help="Only list the files that would be processed")
+@click.option("--resume", is_flag=True, help="Skip the files handled by a previous, interrupted backfill")
+@click.option("--state-file", default=None, type=click.Path(dir_okay=False), help="Progress file used by --resume (default: next to the database)")
+@click.option("--min-age", default=600, show_default=True, type=int, help="Skip files modified less than this many seconds ago")
+@click.option("--data_stream", "-d", default="commissioning", show_default=True, type=str, help="Data stream of the files in data_path")
+@click.option("--run_start_instance", "-i", default="lrsctrl", show_default=True, type=str, help="Run start instance written to the database")
+def backfill(workers, dry_run, resume, state_file, min_age, data_stream, run_start_instance):
+    """Build the missing .data.json sidecars and lrs_runs_data rows"""
+    from lrsctrl.backfill import backfill
+    backfill(workers=workers, dry_run=dry_run, resume=resume, state_file=state_file,
+             min_age=min_age, data_stream=data_stream, run_start_instance=run_start_instance)
@@ -1,6 +1,7 @@
 import requests
 from lrscfg.config import Config
 import json
+import time
 
 
 class Client():
@@ -36,19 +37,85 @@ class Client():
     def start_calib_run(self):
         addr = f'{self.url}/api/start_calib_run/'
         print(addr)
-        try:
-            requests.get(addr)
-        except:
-            print(f'Server disconected or script failed!')
+        return self._start_job(addr)
 
     #Pulser scan run controls
     def start_pulser_scan(self):
         addr = f'{self.url}/api/start_pulser_scan/'
         print(addr)
+        return self._start_job(addr)
+
+    def _start_job(self, addr):
+        """
+            Start a background job on the server, return its id
+        """
+        result = self._get_json(addr)
+        if result is None:
+            return None
+        print(f'Job started: {result["job_id"]}')
+        return result["job_id"]
+
+    #Background jobs
+    def list_jobs(self):
+        return self._get_json(f'{self.url}/api/jobs')
+
+    def get_job(self, job_id):
+        return self._get_json(f'{self.url}/api/jobs/{job_id}')
+
+    def get_job_log(self, job_id, since=0):
+        return self._get_json(f'{self.url}/api/jobs/{job_id}/log', {"since": since})
+
+    def cancel_job(self, job_id):
+        addr = f'{self.url}/api/jobs/{job_id}/cancel'
         try:
-            requests.get(addr)
+            resp = requests.post(addr)
         except:
             print(f'Server disconected or script failed!')
+            return None
+        if not resp.ok:
+            print(f'Cancel failed ({resp.status_code}): {resp.json().get("error")}')
+            return None
+        return resp.json()
+
+    def follow_job(self, job_id, period=2):
+        """
+            Print the job log and progress until the job is finished
+        """
+        since = 0
+        while True:
+            lines = self.get_job_log(job_id, since) or []
+            for entry in lines:
+                print(entry["line"])
+                since = entry["seq"] + 1
+            job = self.get_job(job_id)
+            if job is None:
+                return None
+            if job["state"] in ("done", "failed", "cancelled"):
+                print(f'Job {job_id} {job["state"]} after {job["elapsed"]:.0f} s' + (f': {job["error"]}' if job["error"] else ''))
+                return job
+            time.sleep(period)
+
+    #Live events
+    def stream_events(self, types=None):
+        """
+            Yield the run and file events pushed by the server as dicts,
+            reconnecting (from the last received event) if the stream drops
+        """
+        addr = f'{self.url}/api/events'
+        params = {"types": ",".join(types)} if types else {}
+        last_id = None
+        while True:
+            headers = {"Last-Event-ID": str(last_id)} if last_id is not None else {}
+            try:
+                with requests.get(addr, params=params, headers=headers, stream=True, timeout=(5, 60)) as r:
+                    for line in r.iter_lines(chunk_size=1, decode_unicode=True):
+                        if line and line.startswith('data:'):
+                            event = json.loads(line[5:])
+                            last_id = event["id"]
+                            yield event
+            except requests.exceptions.RequestException as e:
+                print(f'Event stream interrupted ({e}), reconnecting')
+                time.sleep(2)
 
     #Calibration run controls
     def start_test(self):
@@ -87,3 +154,31 @@ class Client():
             requests.get(addr)
         except:
             print(f'Server disconected or script failed!')
+
+    # Run catalog queries
+    def _get_json(self, addr, params=None):
+        try:
+            resp = requests.get(addr, params=params)
+        except:
+            print(f'Server disconected or script failed!')
+            return None
+        if not resp.ok:
+            print(f'Query failed ({resp.status_code}): {resp.json().get("error")}')
+            return None
+        return resp.json()
+
+    def get_runs(self, by_subrun=False, **filters):
+        addr = f'{self.url}/api/runs'
+        params = {k: v for k, v in filters.items() if v is not None}
+        if by_subrun:
+            params["by"] = "subrun"
+        return self._get_json(addr, params)
+
+    def get_run(self, run, afi=False):
+        addr = f'{self.url}/api/runs/{run}'
+        return self._get_json(addr, {"afi": 1} if afi else None)
+
+    def get_run_files(self, **filters):
+        addr = f'{self.url}/api/runs/files'
+        params = {k: v for k, v in filters.items() if v is not None}
+        return self._get_json(addr, params)
@@ -0,0 +1,169 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import lrsctrl.metrics as metrics
+from lrsctrl.metadata import create_runs_table, metadata_row, afi_blobs, INSERT_RUNS_DATA, INSERT_AFI_CONFIG
+from lrsctrl.scan_cache import create_scan_cache_table, INSERT_SCAN_CACHE
+
+BATCH_SIZE = 64
+FLUSH_INTERVAL = 1.0 # s, max time a row waits for its batch to be committed
+MAX_RETRIES = 8
+RETRY_BACKOFF = 0.1 # s, doubled at each retry
+
+
+def is_locked_error(e):
+    msg = str(e).lower()
+    return 'locked' in msg or 'busy' in msg
+
+
+class RunsDBWriter:
+    """
+        Single long-lived writer of lrs_runs_data (and of the lrs_scan_cache
+        rows of the same files).
+
+        One thread owns the connection, switches the database to WAL (readers
+        are no longer blocked while it commits) and groups the queued rows
+        into one transaction per batch. 'database is locked' errors are
+        retried with an exponential backoff.
+
+        submit() returns a concurrent.futures.Future resolved once the row is
+        committed, so callers do not wait on the commit fsync.
+    """
+    def __init__(self, db_path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_retries=MAX_RETRIES, logger=None):
+        self.db_path = str(db_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.logger = logger or logging.getLogger(__name__)
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='runs-db-writer', daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        """
+            Commit the queued rows and stop the writer thread
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, meta, args, cache_rows=(), replace=False):
+        """
+            Queue the lrs_runs_data row of a file (none if `meta` is None) and
+            its lrs_scan_cache rows. replace: delete the rows of the same
+            filename first (file processed again)
+        """
+        future = Future()
+        if meta is None:
+            row, afi = None, {}
+        else:
+            afi = afi_blobs(args)
+            row = metadata_row(meta, args, afi)
+        self.queue.put(((row, list(afi.values()), list(cache_rows), replace), future))
+        return future
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._retry(lambda: self._create(conn))
+        return conn
+
+    @staticmethod
+    def _create(conn):
+        with conn:
+            create_runs_table(conn.cursor())
+            create_scan_cache_table(conn)
+
+    def _retry(self, func):
+        delay = RETRY_BACKOFF
+        for i in range(self.max_retries + 1):
+            try:
+                return func()
+            except sqlite3.OperationalError as e:
+                if not is_locked_error(e) or i == self.max_retries:
+                    raise
+                self.logger.warning(f"Runs database locked, retry in {delay:.1f} s ({i+1}/{self.max_retries})")
+                time.sleep(delay)
+                delay *= 2
+
+    def _next_batch(self):
+        """
+            Block for one row then gather the rows arriving within flush_interval
+        """
+        item = self.queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write(self, conn, batch):
+        # The AFI JSONs of a run are identical, insert each content once
+        blobs = {blob[0]: blob for (_, afi, _, _), _ in batch for blob in afi}
+        def insert():
+            with conn:
+                conn.executemany(INSERT_AFI_CONFIG, blobs.values())
+                if any(replace for (_, _, _, replace), _ in batch):
+                    # In order, a replaced row may be in the same batch
+                    for (row, _, _, replace), _ in batch:
+                        if replace and row is not None:
+                            conn.execute('DELETE FROM lrs_runs_data WHERE filename = ?', (row[0],))
+                        if row is not None:
+                            conn.execute(INSERT_RUNS_DATA, row)
+                else:
+                    conn.executemany(INSERT_RUNS_DATA, [row for (row, _, _, _), _ in batch if row is not None])
+                conn.executemany(INSERT_SCAN_CACHE, [c for (_, _, cache, _), _ in batch for c in cache])
+        with metrics.DB_WRITE_SECONDS.time():
+            self._retry(insert)
+
+    def _run(self):
+        conn = None
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if not batch:
+                continue
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._write(conn, batch)
+            except Exception as e:
+                self.logger.exception(f"Failed to write {len(batch)} rows to {self.db_path}")
+                metrics.DB_ROWS.inc(len(batch), result='failed')
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.logger.debug(f"{len(batch)} rows committed to lrs_runs_data")
+            metrics.DB_ROWS.inc(len(batch), result='ok')
+            for _, future in batch:
+                future.set_result(None)
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import numpy as np
+
+# One record per event found in the .data file
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('unix_ms', '<u8'), ('tai', '<u4')])
+INDEX_SUFFIX = '.idx'
+
+
+def index_path(datafile):
+    """
+        Sidecar path of the event index, e.g. mpd_run_1_p0.data.idx
+    """
+    datafile = Path(datafile)
+    return datafile.with_suffix(datafile.suffix + INDEX_SUFFIX)
+
+
+def make_index(offsets, unix_ms, tai):
+    index = np.empty(len(offsets), dtype=INDEX_DTYPE)
+    index['offset'] = offsets
+    index['unix_ms'] = unix_ms
+    index['tai'] = tai
+    return index
+
+
+def write_index(datafile, index):
+    """
+        Save `index` as a .npy array next to `datafile`. The file is written
+        under a temporary name and renamed so readers never see a partial index.
+    """
+    path = index_path(datafile)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, np.asarray(index, dtype=INDEX_DTYPE))
+    tmp.replace(path)
+    return path
+
+
+def load_index(datafile, mmap=True):
+    """
+        Load the event index of `datafile` (memory mapped by default)
+    """
+    return np.load(index_path(datafile), mmap_mode='r' if mmap else None)
+
+
+def event_offset(index, n):
+    """
+        Byte offset of event number `n` (0-based, negative counts from the end)
+    """
+    return int(index['offset'][n])
+
+
+def find_event_by_time(index, unix_ms):
+    """
+        Position in `index` of the first event with a unix timestamp >= unix_ms,
+        found by bisection. Return len(index) if there is none.
+    """
+    return int(np.searchsorted(index['unix_ms'], unix_ms, side='left'))
+
+
+def find_event_by_tai(index, tai):
+    """
+        Position in `index` of the first event with a TAI timestamp >= tai
+    """
+    return int(np.searchsorted(index['tai'], tai, side='left'))
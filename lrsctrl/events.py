@@ -0,0 +1,105 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+HISTORY = 1000 # events kept to replay to reconnecting clients
+SUBSCRIBER_QUEUE = 2 * HISTORY
+KEEPALIVE = 15 # s between SSE comments on an idle stream
+
+
+class Subscription:
+    def __init__(self, bus, types=None):
+        self.bus = bus
+        self.types = set(types) if types else None
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.dropped = False
+
+    def wants(self, event):
+        # "file" selects file.discovered, file.closed, ...
+        return self.types is None or event['type'] in self.types or event['type'].split('.')[0] in self.types
+
+    def get(self, timeout=None):
+        """
+            Next event, None on timeout
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """
+        In-process publish/subscribe of the run and file state changes.
+
+        publish() never blocks: a subscriber that does not keep up (full
+        queue) is dropped and its stream ends, the client reconnects with
+        Last-Event-ID and gets the missed events from the history.
+    """
+    def __init__(self, history=HISTORY, logger=None):
+        self.history = deque(maxlen=history)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.logger = logger or logging.getLogger(__name__)
+        self._ids = itertools.count(1)
+
+    def publish(self, type, **data):
+        with self.lock:
+            event = {"id": next(self._ids), "time": time.time(), "type": type, "data": data}
+            self.history.append(event)
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            if not sub.wants(event):
+                continue
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                self.logger.warning("Event stream subscriber too slow, dropped")
+                sub.dropped = True
+                self.unsubscribe(sub)
+        return event
+
+    def subscribe(self, types=None, last_id=None):
+        """
+            New Subscription; with `last_id` the newer events of the history are queued first
+        """
+        sub = Subscription(self, types)
+        with self.lock:
+            if last_id is not None:
+                for event in self.history:
+                    if event['id'] > last_id and sub.wants(event):
+                        sub.queue.put_nowait(event)
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+
+
+def sse_format(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+def sse_stream(sub, keepalive=KEEPALIVE):
+    """
+        Generator of the text/event-stream body of a subscription
+    """
+    try:
+        yield "retry: 2000\n\n"
+        while not sub.dropped:
+            event = sub.get(timeout=keepalive)
+            if event is None:
+                # Comment line, also detects the closed connections
+                yield ": keepalive\n\n"
+            else:
+                yield sse_format(event)
+    finally:
+        sub.close()
@@ -0,0 +1,183 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+LOG_LINES = 1000 # log lines kept per job
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+        Long control action (calibration run, pulser scan) executed in the
+        background. The job function reports its progress with set_progress()
+        and calls check_cancelled() at the points where it can stop cleanly.
+    """
+    def __init__(self, job_id, kind, exclusive=True):
+        self.id = job_id
+        self.kind = kind
+        self.exclusive = exclusive
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.current = 0
+        self.total = None
+        self.step = None
+        self.error = None
+        self.result = None
+        self.log = deque(maxlen=LOG_LINES)
+        self._log_seq = itertools.count()
+        self._cancel = threading.Event()
+
+    def set_progress(self, current, total=None, step=None):
+        self.current = current
+        if total is not None:
+            self.total = total
+        if step is not None:
+            self.step = step
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def append_log(self, line):
+        self.log.append((next(self._log_seq), line))
+
+    def log_since(self, since=0):
+        return [{"seq": seq, "line": line} for seq, line in list(self.log) if seq >= since]
+
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.time()) - self.started
+
+    def eta(self):
+        """
+            Remaining time extrapolated from the mean duration of the finished subruns
+        """
+        if self.state != RUNNING or not self.total or not self.current:
+            return None
+        return self.elapsed() / self.current * (self.total - self.current)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "created": datetime.fromtimestamp(self.created).isoformat(),
+            "current": self.current,
+            "total": self.total,
+            "step": self.step,
+            "elapsed": self.elapsed(),
+            "eta": self.eta(),
+            "cancel_requested": self.cancel_requested,
+            "error": self.error,
+            "result": self.result,
+        }
+
+
+class JobLogHandler(logging.Handler):
+    """
+        Copy the records logged from a job thread into the log of that job
+    """
+    def __init__(self, local):
+        super().__init__(level=logging.DEBUG)
+        self.local = local
+        self.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+
+    def emit(self, record):
+        job = getattr(self.local, 'job', None)
+        if job is not None:
+            job.append_log(self.format(record))
+
+
+class JobManager:
+    """
+        Runs the jobs on a dedicated executor. Only one exclusive job (a run
+        driving the DAQ) may be active at a time.
+    """
+    def __init__(self, logger, max_workers=2, history=100):
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lrsctrl-job')
+        self.jobs = {}
+        self.history = history
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        logger.addHandler(JobLogHandler(self._local))
+
+    def active(self, exclusive_only=True):
+        return [j for j in self.jobs.values()
+                if j.state not in FINISHED_STATES and (j.exclusive or not exclusive_only)]
+
+    def submit(self, kind, func, *args, exclusive=True, **kwargs):
+        """
+            Start func(job, *args, **kwargs) in the background, return the job.
+            Raise RuntimeError if an exclusive job is already active.
+        """
+        with self.lock:
+            if exclusive and self.active():
+                raise RuntimeError(f"Job {self.active()[0].id} ({self.active()[0].kind}) is still active")
+            job = Job(f"{datetime.now():%Y%m%d%H%M%S}-{next(self._ids)}", kind, exclusive)
+            self.jobs[job.id] = job
+            self._trim()
+        self.executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        return [job.to_dict() for job in self.jobs.values()]
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None and job.state not in FINISHED_STATES:
+            job.cancel()
+        return job
+
+    def _trim(self):
+        finished = [i for i, j in self.jobs.items() if j.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def _run(self, job, func, args, kwargs):
+        self._local.job = job
+        job.state = RUNNING
+        job.started = time.time()
+        self.logger.info(f"JOB: {job.kind} job {job.id} started")
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.state = DONE
+        except JobCancelled:
+            job.state = CANCELLED
+        except Exception as e:
+            self.logger.exception(f"JOB: {job.kind} job {job.id} failed")
+            job.error = f"{type(e).__name__}: {e}"
+            job.state = FAILED
+        finally:
+            job.finished = time.time()
+            self.logger.info(f"JOB: {job.kind} job {job.id} {job.state} after {job.elapsed():.0f} s")
+            self._local.job = None
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+DEFAULT_JOURNAL = 'lrsctrl_journal.jsonl'
+COMPACT_EVERY = 10000 # records appended before the journal is rewritten
+DONE = ('catalogued', 'failed')
+
+
+class RunJournal:
+    """
+        Append-only JSONL journal of the run info (CUR_RUN) and of the state
+        of the data files, so a restarted server knows the current run and
+        which files still have to be processed.
+
+        {"type": "run", "seq": 3, "run": {...}}
+        {"type": "file", "path": "...", "state": "closed", "run_seq": 3}
+
+        The records are written and fsynced by a writer thread, in order
+        and one fsync per group of records queued together, so the callers
+        (the watcher, the pipeline listener) never wait on the disk. A torn
+        last line (crash during a write) is ignored on replay. The file
+        records refer to the run record by its seq, the run info (with its
+        AFI JSONs) is written once.
+    """
+    def __init__(self, path, logger=None, compact_every=COMPACT_EVERY):
+        self.path = str(path)
+        self.logger = logger or logging.getLogger(__name__)
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.run_seq = 0
+        self.runs = {}
+        self.files = {}
+        self.n_records = 0
+        self._f = None
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def _append(self, record):
+        # Called with the lock held: the records are queued in order
+        record['t'] = time.time()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='run-journal', daemon=True)
+            self.thread.start()
+        self.queue.put(json.dumps(record, default=str) + '\n')
+
+    def _run(self):
+        while True:
+            lines = [self.queue.get()]
+            while True:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in lines
+            lines = [line for line in lines if line is not None]
+            try:
+                if self._f is None:
+                    self._f = open(self.path, 'a')
+                self._f.writelines(lines)
+                self._f.flush()
+                os.fsync(self._f.fileno())
+                self.n_records += len(lines)
+                if self.n_records >= self.compact_every:
+                    with self.lock:
+                        self._compact()
+            except OSError as e:
+                self.logger.error(f"Journal {self.path}: {len(lines)} records not written: {e}")
+            if stop:
+                return
+
+    def _seq_of(self, run):
+        """
+            seq of the run record holding the run info `run`, the current one by default
+        """
+        if run is None or self.runs.get(self.run_seq) == run:
+            return self.run_seq
+        for seq in sorted(self.runs, reverse=True):
+            if self.runs[seq] == run:
+                return seq
+        return self.run_seq
+
+    def record_run(self, run):
+        with self.lock:
+            self.run_seq += 1
+            self.runs[self.run_seq] = run
+            self._append({"type": "run", "seq": self.run_seq, "run": run})
+
+    def record_file(self, path, state, run=None):
+        """
+            run: run info the file was queued with (FileJob.args), the current run by default
+        """
+        with self.lock:
+            path = str(path)
+            run_seq = self._seq_of(run)
+            if state in DONE:
+                self.files.pop(path, None)
+            else:
+                self.files[path] = {"state": state, "run_seq": run_seq}
+            self._append({"type": "file", "path": path, "state": state, "run_seq": run_seq})
+
+    def replay(self):
+        """
+            Read the journal, return (current run info, pending files) where
+            pending is a list of (path, state, run info of the file), oldest first
+        """
+        runs = {}
+        files = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+                    if record.get("type") == "run":
+                        runs[record["seq"]] = record["run"]
+                        self.run_seq = max(self.run_seq, record["seq"])
+                    elif record.get("type") == "file":
+                        if record["state"] in DONE:
+                            files.pop(record["path"], None)
+                        else:
+                            # Re-insert to keep the order of the last state change
+                            files.pop(record["path"], None)
+                            files[record["path"]] = {"state": record["state"], "run_seq": record["run_seq"]}
+        with self.lock:
+            self.runs = runs
+            self.files = {p: f for p, f in files.items() if os.path.exists(p)}
+            self._compact()
+        pending = [(p, f["state"], self.runs.get(f["run_seq"])) for p, f in self.files.items()]
+        return self.runs.get(self.run_seq), pending
+
+    def _compact(self):
+        """
+            Rewrite the journal with only the runs and files still needed
+        """
+        # Older runs are only kept while some of their files are pending
+        needed = {f["run_seq"] for f in self.files.values()} | {self.run_seq}
+        self.runs = {seq: run for seq, run in self.runs.items() if seq in needed}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for seq, run in sorted(self.runs.items()):
+                f.write(json.dumps({"type": "run", "seq": seq, "run": run, "t": time.time()}, default=str) + '\n')
+            for path, state in self.files.items():
+                f.write(json.dumps({"type": "file", "path": path, **state, "t": time.time()}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        os.replace(tmp, self.path)
+        self.n_records = 0
+
+    def close(self):
+        """
+            Write the queued records and stop the writer thread
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
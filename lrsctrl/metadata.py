@@ -2,10 +2,12 @@
 
 import argparse
 import datetime
+import hashlib
 import json
 from pathlib import Path
 import os
 import re
+import time
 import zlib
 import numpy as np
 import sqlite3
@@ -13,15 +15,21 @@ import warnings
 
 import h5py
 
-from lrscfg.client import Client
+from lrscfg.versions import get_resolver
 from lrscfg.config import Config
+from lrsctrl.scanner import DataScanner, CHUNK_SIZE
+from lrsctrl.syncword import find_first_sync, find_last_sync, read_header
+from lrsctrl.event_index import write_index
+from lrsctrl.scan_cache import ScanCache
+import lrsctrl.metrics as metrics
 
 def get_checksum(path: Path):
     cksum = 1
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
     with open(path, 'rb') as f:
-        chunksize = int(1e9)
-        while data := f.read(chunksize):
-            cksum = zlib.adler32(data, cksum)
+        while n := f.readinto(buf):
+            cksum = zlib.adler32(view[:n], cksum)
     return cksum & 0xffffffff
 
 
@@ -146,75 +154,48 @@ def get_subrun(path: Path, args):
         raise ValueError("Invalid filename format of %s" % path.name)
 
 def get_first_event(file, args: dict):
-    # Define constants
-    SYNC_BYTES_SIZE = 4
-    TIMESTAMP_SIZE = 8
-    TAI_SIZE = 4
-    EVENT_HEADER_SIZE = SYNC_BYTES_SIZE + TIMESTAMP_SIZE + TAI_SIZE
-
-    # Read first event timestamp
     with open(file, 'rb') as buf:
-        while True:
-            sync_bytes = buf.read(SYNC_BYTES_SIZE)
-            if len(sync_bytes) < SYNC_BYTES_SIZE:
-                break  # End of file reached
-            sync = np.frombuffer(sync_bytes, dtype='u4')
-            if sync == 0x2A50D5AF:
-                buf.seek(8, 1)  # Skip to the timestamp
-                timestamp_bytes = buf.read(TIMESTAMP_SIZE)
-                if len(timestamp_bytes) < TIMESTAMP_SIZE:
-                    raise ValueError("File ended unexpectedly while reading timestamp")
-                unix_ms = np.frombuffer(timestamp_bytes, dtype='u8').item() // 1000  # ms to s
-                buf.seek(12, 1)  # Skip to the timestamp
-                tai_bytes = buf.read(TAI_SIZE)
-                if len(tai_bytes) < TAI_SIZE:
-                    raise ValueError("File ended unexpectedly while reading TAI timestamp")
-                tai_s = np.frombuffer(tai_bytes, dtype='u4').item()
-                
-                return unix_ms, tai_s
-    return -1, -1
-    #raise ValueError("No event found in file")
+        offset = find_first_sync(buf)
+        if offset is None:
+            warnings.warn(f"No event found in {file}")
+            return -1, -1
+        return read_header(buf, offset)
 
 def get_last_event(file, args: dict):
-    CHUNK_SIZE = 4096 * 16
-
     with open(file, 'rb') as buf:
-        buf.seek(0, 2)
-        file_size = buf.tell()
-        num_chunks = -(-file_size // CHUNK_SIZE)
-
-        # Start from the end of the file and search in reverse
-        for chunk_index in range(num_chunks):
-            offset = max(0, file_size - (chunk_index + 1) * CHUNK_SIZE)
-            read_size = min(CHUNK_SIZE, file_size - offset)
-            buf.seek(offset)
-            chunk_data = buf.read(read_size)
-            sync_indices = np.where(np.frombuffer(chunk_data, dtype='u4') == 0x2A50D5AF)[0]
-
-            if len(sync_indices) > 0:
-                event_offset = offset + sync_indices[-1] * 4 + 12
-                buf.seek(event_offset)
-                unix_ms = np.frombuffer(buf.read(8), dtype='u8').item() // 1000  # ms to s
-                buf.seek(12, 1)
-                tai_s = np.frombuffer(buf.read(4), dtype='u4').item()
-                return unix_ms, tai_s
-    return -1, -1
-    #raise ValueError("No event found in file")
-
-def get_metadata(f, args):
-    start_time_unix, start_time_tai = get_first_event(f, args)
-    end_time_unix, end_time_tai = get_last_event(f, args)
-    meta = {}
+        offset = find_last_sync(buf)
+        if offset is None:
+            warnings.warn(f"No event found in {file}")
+            return -1, -1
+        return read_header(buf, offset)
+
+def get_metadata(f, args, scanner=None):
+    """
+        Build the metadata dict of the data file `f`. The file is read once by
+        a DataScanner; pass `scanner` to reuse one that already consumed (part
+        of) the file, only the remaining bytes are then read.
+    """
     path = Path(f)
+    if scanner is None:
+        scanner = DataScanner()
+    start = time.perf_counter()
+    scanned = scanner.size
+    scan = scanner.scan_file(path).result()
+    record_scan(scanner.size - scanned, time.perf_counter() - start)
+    if scanner.first_event is None:
+        warnings.warn(f"No event found in {path}")
+    start_time_unix, start_time_tai = scan['first_event_unix_ms'], scan['first_event_tai']
+    end_time_unix, end_time_tai = scan['last_event_unix_ms'], scan['last_event_tai']
+    meta = {}
     run = get_run(path, args)
     subrun = get_subrun(path, args)
-    cl = Client()
+    versions = get_resolver()
 
     meta['name'] = path.name
     meta['namespace'] = 'neardet-2x2-lar-light'
     meta['checksums'] = {
-        'adler32': f'{get_checksum(path):08x}'}
-    meta['size'] = path.stat().st_size
+        'adler32': f'{scan["adler32"]:08x}'}
+    meta['size'] = scan['size']
 
     md = meta['metadata'] = {
         'core.application.family': 'lrs',
@@ -241,17 +222,55 @@ def get_metadata(f, args):
         'retention.class': 'rawdata',
         'retention.status': 'active',
 
-        'dune.lrs_active_config': cl.get_active_moas(),
-        'dune.lrs_active_thresholds': cl.get_active_foas(),
+        'dune.lrs_active_config': versions.active_moas(),
+        'dune.lrs_active_thresholds': versions.active_foas(),
     }
 
+    metrics.GET_METADATA_SECONDS.observe(time.perf_counter() - start)
     return meta
 
-def dump_metadata(app, args):
+def record_scan(nbytes, seconds):
+    metrics.SCAN_BYTES.inc(nbytes)
+    metrics.SCAN_SECONDS.inc(seconds)
+    if nbytes and seconds > 0:
+        metrics.SCAN_THROUGHPUT.observe(nbytes / seconds / 1e6)
+
+def dump_metadata(app, args, scanner=None):
+    """
+        Write the .json and .idx sidecars of args['datafile'] and add it to the
+        runs database. `scanner` may be a DataScanner (with collect_events)
+        that already followed the file while it was written.
+    """
+    meta = write_metadata_files(app, args, scanner=scanner)
+
+    if 'database' in args:
+        write_metadata_to_db(args['database'], meta, args)
+
+def write_metadata_files(app, args, scanner=None, cache_rows=None):
+    """
+        Write the .json and .idx sidecars of args['datafile'], return the metadata.
+        With a `cache_rows` list the scan cache row is appended to it, for the
+        caller's database writer, instead of being stored here.
+    """
     if app:
         app.logger.debug(f"Entered dump_meta")
     f = args['datafile']
-    meta = get_metadata(f, args)
+    cache = ScanCache(args['database']) if args.get('database') else None
+    if scanner is None and cache is not None:
+        scanner = cache.lookup(f, collect_events=True)
+    # Collect the event offsets in the same pass to write the .idx sidecar
+    if scanner is None:
+        scanner = DataScanner(collect_events=True)
+    elif scanner.size:
+        if app:
+            app.logger.debug(f"Resume scan of {f} at byte {scanner.size}")
+    meta = get_metadata(f, args, scanner=scanner)
+    if cache_rows is not None:
+        row = ScanCache.row(f, scanner)
+        if row is not None:
+            cache_rows.append(row)
+    elif cache is not None:
+        cache.store(f, scanner)
     if app:
         app.logger.debug(f"get_metadata done")
     jsonfile = Path(f).with_suffix(Path(f).suffix + '.json')
@@ -260,16 +279,12 @@ def dump_metadata(app, args):
     with open(jsonfile, 'w') as outf:
         json.dump(meta, outf, indent=4)
         outf.write('\n')
+    idxfile = write_index(f, scanner.events())
+    if app:
+        app.logger.debug(f"Event index written to {idxfile}")
+    return meta
 
-    if 'database' in args:
-        write_metadata_to_db(args['database'], meta, args)
-
-def write_metadata_to_db(db_path, meta,args):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Create table if it doesn't exist
-    cursor.execute('''
+RUNS_DATA_TABLE = '''
     CREATE TABLE IF NOT EXISTS lrs_runs_data (
         filename TEXT,
         size INTEGER,
@@ -287,28 +302,32 @@ def write_metadata_to_db(db_path, meta,args):
         afi_evb_json JSON,
         afi_adc64_sum_json JSON,
         afi_adc64_reg_json JSON,
-        active_foas TEXT
+        active_foas TEXT,
+        afi_runcontrol_ref TEXT,
+        afi_evb_ref TEXT,
+        afi_adc64_sum_ref TEXT,
+        afi_adc64_reg_ref TEXT
     )
-    ''')
-
-    # AFI JSONs should be provided at run start and attached to args under
-    # 'afi_jsons'. Prefer those; otherwise attempt to load them here.
-    afi_runcontrol = afi_evb = afi_adc64_sum = afi_adc64_reg = None
-    afi_dict = None
-    if isinstance(args, dict) and 'afi_jsons' in args:
-        afi_dict = args.get('afi_jsons')
-    else:
-        afi_dict = None
-        warnings.warn("AFI JSONs not provided in args; cannot write to DB")
+    '''
+
+# AFI JSONs are stored once per content, lrs_runs_data only references them
+AFI_CONFIGS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS afi_configs (
+        hash TEXT PRIMARY KEY,
+        compression TEXT,
+        content BLOB
+    )
+    '''
 
-    if afi_dict:
-        afi_runcontrol = json.dumps(afi_dict.get('RunControl')) if 'RunControl' in afi_dict else None
-        afi_evb = json.dumps(afi_dict.get('EvB')) if 'EvB' in afi_dict else None
-        afi_adc64_sum = json.dumps(afi_dict.get('Adc64_sum')) if 'Adc64_sum' in afi_dict else None
-        afi_adc64_reg = json.dumps(afi_dict.get('Adc64_reg')) if 'Adc64_reg' in afi_dict else None
+# AFI key -> (legacy JSON column, reference column) of lrs_runs_data
+AFI_COLUMNS = {
+    'RunControl': ('afi_runcontrol_json', 'afi_runcontrol_ref'),
+    'EvB': ('afi_evb_json', 'afi_evb_ref'),
+    'Adc64_sum': ('afi_adc64_sum_json', 'afi_adc64_sum_ref'),
+    'Adc64_reg': ('afi_adc64_reg_json', 'afi_adc64_reg_ref'),
+}
 
-    # Insert metadata into table (now with 4 extra columns)
-    cursor.execute('''
+INSERT_RUNS_DATA = '''
     INSERT INTO lrs_runs_data (
         filename, 
         size, 
@@ -322,13 +341,86 @@ def write_metadata_to_db(db_path, meta,args):
         first_event_tai, 
         last_event_tai, 
         active_moas,
-        afi_runcontrol_json,
-        afi_evb_json,
-        afi_adc64_sum_json,
-        afi_adc64_reg_json,
+        afi_runcontrol_ref,
+        afi_evb_ref,
+        afi_adc64_sum_ref,
+        afi_adc64_reg_ref,
         active_foas
     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+    '''
+
+INSERT_AFI_CONFIG = 'INSERT OR IGNORE INTO afi_configs (hash, compression, content) VALUES (?, ?, ?)'
+
+# Lookups of the run catalog (lrsctrl.runs_catalog)
+RUNS_DATA_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_lrs_runs_data_run ON lrs_runs_data (morcs_run_nr, subrun)',
+    'CREATE INDEX IF NOT EXISTS idx_lrs_runs_data_filename ON lrs_runs_data (filename)',
+    'CREATE INDEX IF NOT EXISTS idx_lrs_runs_data_start ON lrs_runs_data (start_time_unix)',
+    'CREATE INDEX IF NOT EXISTS idx_lrs_runs_data_moas ON lrs_runs_data (active_moas)',
+]
+
+def create_runs_table(cursor):
+    """
+        Create lrs_runs_data, its indexes and afi_configs, adding the columns
+        missing from a table created by an older version
+    """
+    cursor.execute(RUNS_DATA_TABLE)
+    cursor.execute(AFI_CONFIGS_TABLE)
+    cursor.execute("PRAGMA table_info('lrs_runs_data')")
+    existing_columns = [row[1] for row in cursor.fetchall()]
+    for _, ref_column in AFI_COLUMNS.values():
+        if ref_column not in existing_columns:
+            cursor.execute(f"ALTER TABLE lrs_runs_data ADD COLUMN {ref_column} TEXT")
+    for index in RUNS_DATA_INDEXES:
+        cursor.execute(index)
+
+def afi_blob(afi_json, compress=True):
+    """
+        Content-addressed entry of one AFI JSON: (hash, compression, content).
+        The hash is the sha256 of the canonical (sorted, compact) JSON text.
+    """
+    text = json.dumps(afi_json, sort_keys=True, separators=(',', ':')).encode()
+    digest = hashlib.sha256(text).hexdigest()
+    if compress:
+        return digest, 'zlib', zlib.compress(text)
+    return digest, None, text
+
+def afi_blobs(args, compress=True):
+    """
+        {AFI key: afi_blob} of the AFI JSONs attached to args['afi_jsons']
+    """
+    # AFI JSONs should be provided at run start and attached to args under
+    # 'afi_jsons'.
+    if isinstance(args, dict) and 'afi_jsons' in args:
+        afi_dict = args.get('afi_jsons') or {}
+    else:
+        afi_dict = {}
+        warnings.warn("AFI JSONs not provided in args; cannot write to DB")
+    return {key: afi_blob(afi_dict[key], compress) for key in AFI_COLUMNS if key in afi_dict}
+
+def load_afi_blob(cursor, ref):
+    """
+        AFI JSON stored under the hash `ref` in afi_configs, or None
+    """
+    cursor.execute('SELECT compression, content FROM afi_configs WHERE hash = ?', (ref,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    compression, content = row
+    if compression == 'zlib':
+        content = zlib.decompress(content)
+    return json.loads(content)
+
+def metadata_row(meta, args, afi=None):
+    """
+        Values of the lrs_runs_data row of a file, in INSERT_RUNS_DATA order.
+        `afi` is the afi_blobs(args) result, computed if not given.
+    """
+    if afi is None:
+        afi = afi_blobs(args)
+    afi_refs = [afi[key][0] if key in afi else None for key in AFI_COLUMNS]
+
+    return (
         meta['name'],
         meta['size'],
         meta['metadata']['core.application.version'],
@@ -341,15 +433,30 @@ def write_metadata_to_db(db_path, meta,args):
         meta['metadata']['core.first_event_number'],
         meta['metadata']['core.last_event_number'],
         meta['metadata']['dune.lrs_active_config'],
-        afi_runcontrol,
-        afi_evb,
-        afi_adc64_sum,
-        afi_adc64_reg,
+        *afi_refs,
         meta['metadata']['dune.lrs_active_thresholds']
-    ))
+    )
+
+def write_metadata_to_db(db_path, meta,args):
+    """
+        Insert one file with a short lived connection. The server and the
+        backfill use the batched lrsctrl.db_writer.RunsDBWriter instead.
+    """
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=30)
+    cursor = conn.cursor()
+
+    # Create table if it doesn't exist
+    create_runs_table(cursor)
+
+    afi = afi_blobs(args)
+    cursor.executemany(INSERT_AFI_CONFIG, afi.values())
+    cursor.execute(INSERT_RUNS_DATA, metadata_row(meta, args, afi))
 
     conn.commit()
     conn.close()
+    metrics.DB_WRITE_SECONDS.observe(time.perf_counter() - start)
+    metrics.DB_ROWS.inc(result='ok')
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
@@ -0,0 +1,174 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in s, from a fast DB commit to a slow multi-GB checksum
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, '') for n in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines += self.samples()
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [f'{self.name}{_labels(self.label_names, k)} {_format(v)}' for k, v in items]
+
+
+class Gauge(Metric):
+    """
+        Gauge set explicitly or, with `func`, read when the metrics are rendered
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), func=None):
+        super().__init__(name, help, labels)
+        self.values = {}
+        self.func = func
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def samples(self):
+        if self.func is not None:
+            try:
+                return [f'{self.name} {_format(self.func())}']
+            except Exception:
+                return []
+        with self.lock:
+            items = list(self.values.items())
+        return [f'{self.name}{_labels(self.label_names, k)} {_format(v)}' for k, v in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.values = {}  # key: [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self.values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _labels(self.label_names + ('le',), key + (_format(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            # Re-registering a name (e.g. a module reload) returns the existing metric
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """
+            All metrics in the Prometheus text exposition format
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def gauge(name, help, labels=(), func=None):
+    return REGISTRY.register(Gauge(name, help, labels, func))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+# Metrics shared by the modules of lrsctrl
+SCAN_BYTES = counter('lrsctrl_scan_bytes_total', 'Bytes of data files read by the scanner')
+SCAN_SECONDS = counter('lrsctrl_scan_seconds_total', 'Time spent scanning data files')
+SCAN_THROUGHPUT = histogram('lrsctrl_scan_throughput_mbytes_per_second', 'Checksum throughput per file (MB/s)',
+                            buckets=(10, 25, 50, 100, 200, 400, 800, 1600, 3200))
+GET_METADATA_SECONDS = histogram('lrsctrl_get_metadata_seconds', 'Time in get_metadata per file')
+DB_WRITE_SECONDS = histogram('lrsctrl_db_write_seconds', 'Time to commit lrs_runs_data rows, per transaction')
+DB_ROWS = counter('lrsctrl_db_rows_total', 'lrs_runs_data rows written', labels=('result',))
+DAQ_COMMANDS = counter('lrsctrl_daq_commands_total', 'Commands sent to the DAQ listeners',
+                       labels=('command', 'result'))
+DAQ_COMMAND_LATENCY = histogram('lrsctrl_daq_command_ack_seconds', 'Round trip of the acknowledged DAQ commands',
+                                labels=('command',))
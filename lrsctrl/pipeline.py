@@ -0,0 +1,225 @@
+import logging
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+
+# File states, in order
+DISCOVERED = 'discovered'   # created by the DAQ, still being written
+CLOSED = 'closed'           # finished, queued for processing
+HASHED = 'hashed'           # checksum, metadata and index sidecars written
+CATALOGUED = 'catalogued'   # row inserted in the runs database
+FAILED = 'failed'
+
+DONE_STATES = (CATALOGUED, FAILED)
+
+
+def run_key(path):
+    """
+        Key grouping the files of one run: mpd_<name>_<run>_pNN.data -> <name>_<run>
+    """
+    path = Path(path)
+    match = re.match(r"mpd_(.*?)_(\d+)(?:_p\d+)?\.data", path.name)
+    if match:
+        return f"{match.group(1)}_{match.group(2)}"
+    return str(path.parent)
+
+
+class FileJob:
+    def __init__(self, path, listener=None):
+        self.path = str(path)
+        self.listener = listener
+        self.run_key = run_key(path)
+        self.args = None
+        self.size = None        # bytes processed, set by the process function
+        self.replaces = False   # processed before, its catalogue entry is replaced
+        self.state = DISCOVERED
+        self.times = {DISCOVERED: time.time()}
+        self.error = None
+        self.done = threading.Event()
+
+    def advance(self, state, error=None):
+        self.state = state
+        self.times[state] = time.time()
+        if error is not None:
+            self.error = str(error)
+        if state in DONE_STATES:
+            self.done.set()
+        if self.listener is not None:
+            self.listener(self)
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "run_key": self.run_key,
+            "state": self.state,
+            "replaces": self.replaces,
+            "times": dict(self.times),
+            "error": self.error,
+        }
+
+
+class FilePipeline:
+    """
+        Post-processing of the closed data files on a pool of worker threads.
+
+        Each worker consumes its own bounded queue and the files of a run are
+        always routed to the same worker, so they are processed in order while
+        different runs proceed in parallel. submit() blocks when the queue is
+        full (backpressure on the watcher instead of unbounded memory).
+
+        `process(job)` does the work and moves the job to HASHED and
+        CATALOGUED, possibly later from another thread (e.g. once its
+        database row is committed); an exception marks the job FAILED.
+        `listener(job)` is called after each state change, including DISCOVERED.
+        post() runs other work of a file (e.g. its tail scan) on the same worker.
+    """
+    def __init__(self, process, n_workers=2, queue_size=16, logger=None, history=1000, listener=None):
+        self.process = process
+        self.listener = listener
+        self.n_workers = max(1, int(n_workers))
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(self.n_workers)]
+        self.logger = logger or logging.getLogger(__name__)
+        self.history = history
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        for i, q in enumerate(self.queues):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"file-worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+        return self
+
+    def stop(self):
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def discover(self, path):
+        """
+            Register a new file seen by the watcher
+        """
+        with self.lock:
+            job = self.jobs.get(str(path))
+            new = job is None or job.state in DONE_STATES
+            if new:
+                job = self.jobs[str(path)] = FileJob(path, self.listener)
+            self._trim()
+        if new and self.listener is not None:
+            self.listener(job)
+        return job
+
+    def reopen(self, path, size):
+        """
+            Register again a file processed (HASHED or CATALOGUED) at another
+            size than `size`: it was written after it was closed. The new job
+            keeps the run info of the first one. Return it, or None.
+        """
+        with self.lock:
+            job = self.jobs.get(str(path))
+            if job is None or job.state not in (HASHED, CATALOGUED) or job.size in (None, size):
+                return None
+            new = self.jobs[str(path)] = FileJob(path, self.listener)
+            new.args = job.args
+            new.replaces = True
+        if self.listener is not None:
+            self.listener(new)
+        return new
+
+    def submit(self, path, args):
+        """
+            Queue the closed file `path` with a snapshot of the run info `args`
+            (a reopened file keeps its first one)
+        """
+        with self.lock:
+            job = self.jobs.get(str(path))
+        if job is None:
+            job = self.discover(path)
+        # The watcher and the run control may both submit the same file
+        with self.lock:
+            if job.state != DISCOVERED:
+                self.logger.debug(f"File {path} already {job.state}, not queued again")
+                return job
+            if not job.replaces:
+                job.args = args
+            job.advance(CLOSED)
+        q = self.queues[hash(job.run_key) % self.n_workers]
+        try:
+            q.put_nowait(job)
+        except queue.Full:
+            self.logger.warning(f"File processing queue full, waiting to queue {path}")
+            q.put(job)
+        return job
+
+    def post(self, path, task):
+        """
+            Run task() on the worker of the run of `path`, after the files
+            already queued. Return False, task dropped, if that queue is full.
+        """
+        q = self.queues[hash(run_key(path)) % self.n_workers]
+        try:
+            q.put_nowait(task)
+        except queue.Full:
+            return False
+        return True
+
+    def state(self, path):
+        with self.lock:
+            job = self.jobs.get(str(path))
+            return job.state if job is not None else None
+
+    def wait(self, path, timeout=None):
+        """
+            Wait until `path` is catalogued or failed, return its job
+        """
+        job = self.jobs.get(str(path))
+        if job is not None:
+            job.done.wait(timeout)
+        return job
+
+    def join(self):
+        """
+            Wait until every queued file is processed
+        """
+        for q in self.queues:
+            q.join()
+
+    def queue_depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def status(self):
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def _trim(self):
+        # Forget the oldest finished jobs
+        done = [p for p, j in self.jobs.items() if j.state in DONE_STATES]
+        for p in done[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[p]
+
+    def _worker(self, q):
+        while True:
+            job = q.get()
+            if job is None:
+                q.task_done()
+                return
+            if callable(job):
+                try:
+                    job()
+                except Exception:
+                    self.logger.exception("File task failed")
+                finally:
+                    q.task_done()
+                continue
+            try:
+                self.process(job)
+            except Exception as e:
+                self.logger.exception(f"Processing of {job.path} failed")
+                job.advance(FAILED, e)
+            finally:
+                q.task_done()
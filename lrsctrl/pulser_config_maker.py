@@ -5,7 +5,7 @@ from datetime import datetime
 import json
 import shutil
 
-from lrscfg.client import Client
+from lrscfg.versions import get_resolver
 from lrscfg.config import Config
 
 
@@ -96,7 +96,7 @@ def check_valid_led_id(led_id):
 def make(app):
 
 	app.logger.debug("Read the config info")
-	moas_name = Client().get_active_moas()
+	moas_name = get_resolver().active_moas()
 	moas_path = os.path.join(Config().parse_yaml()["moas_path"], moas_name)
 	# print(f" MOAS: {moas_name}")
 	moas_df = pd.read_csv(moas_path, usecols=["led_group_id_warm","tpc"])
@@ -0,0 +1,146 @@
+import json
+import sqlite3
+
+from lrsctrl.metadata import AFI_COLUMNS, load_afi_blob
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 10000
+
+# The subrun column holds core.runs_subruns: 10000*run + subrun
+SUBRUN = 'subrun - 10000 * morcs_run_nr'
+
+FILE_COLUMNS = [
+    'filename',
+    'size',
+    'run_mode',
+    'run_start_instance',
+    'morcs_run_nr',
+    f'{SUBRUN} AS subrun',
+    'start_time_unix',
+    'end_time_unix',
+    'first_event_tai',
+    'last_event_tai',
+    'active_moas',
+    'active_foas',
+    'application_version',
+]
+
+SUMMARY_COLUMNS = [
+    'COUNT(*) AS n_files',
+    'SUM(size) AS total_size',
+    'MIN(start_time_unix) AS start_time_unix',
+    'MAX(end_time_unix) AS end_time_unix',
+    'MIN(first_event_tai) AS first_event_tai',
+    'MAX(last_event_tai) AS last_event_tai',
+    "GROUP_CONCAT(DISTINCT run_mode) AS run_mode",
+    "GROUP_CONCAT(DISTINCT active_moas) AS active_moas",
+]
+
+
+def connect(db_path):
+    """
+        Read-only connection to the runs database
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _where(run=None, subrun=None, filename=None, start=None, end=None, moas=None, data_stream=None):
+    """
+        WHERE clause and parameters of the catalog filters. `filename` accepts
+        shell-like wildcards (*, ?). `start`/`end` select the files overlapping
+        the unix time range. `subrun` is the number within the run.
+    """
+    clauses = []
+    params = []
+    if run is not None:
+        clauses.append('morcs_run_nr = ?')
+        params.append(int(run))
+    if subrun is not None and run is not None:
+        # Matches the stored value, the index is used
+        clauses.append('subrun = ?')
+        params.append(10000 * int(run) + int(subrun))
+    elif subrun is not None:
+        clauses.append(f'{SUBRUN} = ?')
+        params.append(int(subrun))
+    if filename:
+        if '*' in filename or '?' in filename:
+            clauses.append('filename GLOB ?')
+        else:
+            clauses.append('filename = ?')
+        params.append(filename)
+    if start is not None:
+        clauses.append('end_time_unix >= ?')
+        params.append(int(start))
+    if end is not None:
+        clauses.append('start_time_unix <= ?')
+        params.append(int(end))
+    if moas:
+        clauses.append('active_moas = ?')
+        params.append(moas)
+    if data_stream:
+        clauses.append('run_mode = ?')
+        params.append(data_stream)
+    where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    return where, params
+
+
+def _page(limit, offset):
+    limit = DEFAULT_LIMIT if limit is None else max(1, min(int(limit), MAX_LIMIT))
+    offset = 0 if offset is None else max(0, int(offset))
+    return limit, offset
+
+
+def query_files(conn, limit=None, offset=None, **filters):
+    """
+        Files matching `filters` (see _where), newest first
+    """
+    limit, offset = _page(limit, offset)
+    where, params = _where(**filters)
+    rows = conn.execute(
+        f'SELECT {", ".join(FILE_COLUMNS)} FROM lrs_runs_data {where} '
+        'ORDER BY start_time_unix DESC, filename DESC LIMIT ? OFFSET ?',
+        params + [limit, offset]).fetchall()
+    return {'items': [dict(r) for r in rows], 'limit': limit, 'offset': offset}
+
+
+def summarize_runs(conn, by_subrun=False, limit=None, offset=None, **filters):
+    """
+        Aggregates per run (or per run and subrun): file count, total size,
+        start/end time and TAI range, newest run first
+    """
+    limit, offset = _page(limit, offset)
+    where, params = _where(**filters)
+    group = ['morcs_run_nr', 'subrun'] if by_subrun else ['morcs_run_nr']
+    columns = ['morcs_run_nr', f'{SUBRUN} AS subrun'] if by_subrun else ['morcs_run_nr']
+    rows = conn.execute(
+        f'SELECT {", ".join(columns + SUMMARY_COLUMNS)} FROM lrs_runs_data {where} '
+        f'GROUP BY {", ".join(group)} '
+        f'ORDER BY MIN(start_time_unix) DESC, {", ".join(g + " DESC" for g in group)} LIMIT ? OFFSET ?',
+        params + [limit, offset]).fetchall()
+    return {'items': [dict(r) for r in rows], 'limit': limit, 'offset': offset}
+
+
+def run_afi(conn, run):
+    """
+        AFI JSONs the files of `run` were recorded with: {AFI key: [JSON, ...]},
+        one entry per distinct configuration. They are read from afi_configs,
+        or from the inline afi_*_json columns of the older rows.
+    """
+    cursor = conn.cursor()
+    afi = {}
+    for key, (json_column, ref_column) in AFI_COLUMNS.items():
+        rows = conn.execute(
+            f'SELECT DISTINCT {ref_column}, {json_column} FROM lrs_runs_data WHERE morcs_run_nr = ?',
+            (int(run),)).fetchall()
+        configs = []
+        for ref, text in rows:
+            if ref is not None:
+                config = load_afi_blob(cursor, ref)
+            else:
+                config = json.loads(text) if text is not None else None
+            if config is not None and config not in configs:
+                configs.append(config)
+        afi[key] = configs
+    return afi
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from lrsctrl.scanner import DataScanner
+from lrsctrl.event_index import load_index
+
+TAIL_BLOCK = 64 * 1024 # bytes before the cached size checked before a scan is resumed
+
+SCAN_CACHE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS lrs_scan_cache (
+        device INTEGER,
+        inode INTEGER,
+        size INTEGER,
+        mtime_ns INTEGER,
+        path TEXT,
+        state JSON,
+        tail_sha256 TEXT,
+        PRIMARY KEY (device, inode)
+    )
+'''
+
+INSERT_SCAN_CACHE = '''
+    INSERT OR REPLACE INTO lrs_scan_cache (device, inode, size, mtime_ns, path, state, tail_sha256)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def create_scan_cache_table(conn):
+    """
+        Create lrs_scan_cache, adding the columns missing from a table created
+        by an older version
+    """
+    conn.execute(SCAN_CACHE_TABLE)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info('lrs_scan_cache')")]
+    if 'tail_sha256' not in columns:
+        conn.execute("ALTER TABLE lrs_scan_cache ADD COLUMN tail_sha256 TEXT")
+
+
+def tail_sha256(path, size):
+    """
+        sha256 of the TAIL_BLOCK bytes of `path` before offset `size`
+    """
+    start = max(0, size - TAIL_BLOCK)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(size - start)
+    if len(data) != size - start:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
+
+class ScanCache:
+    """
+        Persistent DataScanner states in the runs database, keyed by the file
+        identity (device, inode) and validated against its size and mtime.
+
+        - same size and mtime_ns: the file is unchanged, the cached scan is
+          returned and nothing is read
+        - larger size: the file grew, the scan resumes after the cached bytes
+          if the last block of them is unchanged (tail_sha256)
+        - anything else: no cache entry, the file is scanned from the start
+
+        The server and the backfill insert the rows from row() with their
+        single database writer (RunsDBWriter), store() is for the standalone
+        metadata command.
+    """
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def lookup(self, path, collect_events=False):
+        """
+            Return a DataScanner restored for `path`, or None
+        """
+        st = os.stat(path)
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT size, mtime_ns, path, state, tail_sha256 FROM lrs_scan_cache WHERE device = ? AND inode = ?',
+                (st.st_dev, st.st_ino)).fetchone()
+        except sqlite3.OperationalError:
+            return None  # no cache table yet, or of an older version
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        size, mtime_ns, cached_path, state, tail = row
+        if os.path.abspath(path) != cached_path or size > st.st_size:
+            return None
+        if size == st.st_size and mtime_ns != st.st_mtime_ns:
+            return None
+        if size < st.st_size and (tail is None or tail_sha256(path, size) != tail):
+            return None  # not an append, the scanned bytes were rewritten
+        state = json.loads(state)
+
+        events = None
+        if collect_events:
+            # The events already scanned come from the .idx sidecar
+            try:
+                events = load_index(path, mmap=False)
+            except (FileNotFoundError, ValueError):
+                return None
+            last = state['last_event']
+            if (len(events) == 0) != (last is None) or (len(events) and int(events['offset'][-1]) != last[0]):
+                return None
+        return DataScanner.from_state(state, events)
+
+    @staticmethod
+    def row(path, scanner):
+        """
+            lrs_scan_cache row (INSERT_SCAN_CACHE) of the scan of `path`, or None
+        """
+        st = os.stat(path)
+        if st.st_size != scanner.size:
+            # The file changed during the scan, do not cache a stale state
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, os.path.abspath(path), json.dumps(scanner.state()),
+                tail_sha256(path, st.st_size))
+
+    def store(self, path, scanner):
+        row = self.row(path, scanner)
+        if row is None:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                create_scan_cache_table(conn)
+                conn.execute(INSERT_SCAN_CACHE, row)
+        finally:
+            conn.close()
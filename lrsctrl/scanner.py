@@ -0,0 +1,139 @@
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from lrsctrl.syncword import EVENT_HEADER_SIZE, find_sync, decode_header, decode_headers
+from lrsctrl.event_index import make_index
+
+CHUNK_SIZE = 16 * 1024 * 1024 # bytes read per step, the buffer is reused
+
+
+class DataScanner:
+    """
+        Single pass over an ADC64 .data file computing the adler32 checksum,
+        the size and the first/last event (byte offset, unix ms, TAI s).
+
+        The scanner only ever holds one CHUNK_SIZE buffer plus a short tail
+        (< EVENT_HEADER_SIZE bytes) carried between chunks, so an event header
+        crossing a chunk boundary is still decoded.
+
+        With collect_events=True the offset and timestamps of every event are
+        also kept to build the event index (see lrsctrl.event_index).
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, collect_events=False):
+        self.chunk_size = chunk_size
+        self.collect_events = collect_events
+        self.adler32 = 1
+        self.size = 0
+        self.first_event = None
+        self.last_event = None
+        self._tail = b''
+        self._events = []
+
+    @property
+    def checksum(self):
+        return self.adler32 & 0xffffffff
+
+    def scan_file(self, path):
+        """
+            Scan `path` starting at the bytes not seen yet (self.size)
+        """
+        with open(path, 'rb') as f:
+            f.seek(self.size)
+            self.scan(f)
+        return self
+
+    def scan(self, f):
+        """
+            Consume the binary file object `f` until EOF
+        """
+        buf = bytearray(self.chunk_size + EVENT_HEADER_SIZE)
+        view = memoryview(buf)
+        while True:
+            ntail = len(self._tail)
+            view[:ntail] = self._tail
+            n = f.readinto(view[ntail:ntail + self.chunk_size])
+            if not n:
+                break
+            self.adler32 = zlib.adler32(view[ntail:ntail + n], self.adler32)
+            self._search(view[:ntail + n], self.size - ntail)
+            self.size += n
+        view.release()
+        return self
+
+    def _search(self, view, base):
+        """
+            Look for complete event headers in `view`, whose first byte sits at
+            file offset `base`. Bytes that may still start an incomplete header
+            are kept in self._tail for the next chunk.
+        """
+        data = np.frombuffer(view, dtype=np.uint8)
+        n_complete = max(0, len(data) - EVENT_HEADER_SIZE + 1)
+
+        hits = find_sync(view)
+        hits = hits[hits < n_complete]
+
+        if len(hits):
+            if self.first_event is None:
+                self.first_event = (base + int(hits[0]), *decode_header(data, hits[0]))
+            self.last_event = (base + int(hits[-1]), *decode_header(data, hits[-1]))
+            if self.collect_events:
+                unix_ms, tai = decode_headers(data, hits)
+                self._events.append(make_index(base + hits, unix_ms, tai))
+
+        self._tail = bytes(view[n_complete:])
+
+    def events(self):
+        """
+            Event index (structured array) of the events seen so far
+        """
+        if len(self._events) != 1:
+            self._events = [np.concatenate(self._events) if self._events else make_index([], [], [])]
+        return self._events[0]
+
+    def state(self):
+        """
+            JSON serializable state from which the scan can be resumed
+        """
+        return {
+            'adler32': self.adler32,
+            'size': self.size,
+            'first_event': self.first_event,
+            'last_event': self.last_event,
+            'tail': self._tail.hex(),
+        }
+
+    @classmethod
+    def from_state(cls, state, events=None, chunk_size=CHUNK_SIZE):
+        """
+            Rebuild a scanner from state(); pass the event index already
+            written for those bytes in `events` to keep collecting events.
+        """
+        scanner = cls(chunk_size, collect_events=events is not None)
+        scanner.adler32 = state['adler32']
+        scanner.size = state['size']
+        scanner.first_event = tuple(state['first_event']) if state['first_event'] else None
+        scanner.last_event = tuple(state['last_event']) if state['last_event'] else None
+        scanner._tail = bytes.fromhex(state['tail'])
+        if events is not None:
+            scanner._events = [np.array(events)]
+        return scanner
+
+    def result(self):
+        first = self.first_event or (-1, -1, -1)
+        last = self.last_event or (-1, -1, -1)
+        return {
+            'adler32': self.checksum,
+            'size': self.size,
+            'first_event_offset': first[0],
+            'first_event_unix_ms': first[1],
+            'first_event_tai': first[2],
+            'last_event_offset': last[0],
+            'last_event_unix_ms': last[1],
+            'last_event_tai': last[2],
+        }
+
+
+def scan_file(path: Path, chunk_size=CHUNK_SIZE):
+    return DataScanner(chunk_size).scan_file(path)
@@ -1,16 +1,159 @@
+import itertools
+import logging
 import socket
+import threading
+import time
+
+import lrsctrl.metrics as metrics
+from lrscfg.config import config_service
 
 
 SENDER_HOST = 'localhost'
 SENDER_PORT_ADC64 = 6000
 SENDER_PORT_RC = 6001
 
+ACK_TIMEOUT = 1.0 # s per attempt
+ACK_RETRIES = 3
+
+
+class CommandTimeout(Exception):
+    pass
+
 
-class Sender:
-    def __init__(self, port):
+class CommandChannel:
+    """
+        Persistent UDP socket to one DAQ listener.
+
+        With ack=False the command is sent as before ("start_rc"), for the
+        listeners that do not answer. With ack=True it is sent with a request
+        id ("start_rc 42") and the listener must reply "ack 42". A missing ack
+        is retried with the same id, so the listener can ignore duplicates.
+        send() then returns the round-trip latency or raises CommandTimeout.
+    """
+    def __init__(self, port, host=SENDER_HOST, ack=False, timeout=ACK_TIMEOUT, retries=ACK_RETRIES, logger=None):
         self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.connect((SENDER_HOST, self.port))
+        self.host = host
+        self.ack = ack
+        self.timeout = timeout
+        self.retries = retries
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.sock = None
+        # Ids stay unique across server restarts for the duplicate filtering
+        self._ids = itertools.count(int(time.time() * 1000) % 10**12)
+        self.stats = {"sent": 0, "acked": 0, "failed": 0, "retries": 0, "refused": 0,
+                      "last_latency": None, "total_latency": 0.0}
+
+    def configure(self, host=SENDER_HOST, ack=False, timeout=ACK_TIMEOUT, retries=ACK_RETRIES):
+        """
+            Apply the settings (e.g. of a reloaded config.yaml) to the next commands
+        """
+        with self.lock:
+            if host != self.host and self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            self.host = host
+            self.ack = ack
+            self.timeout = timeout
+            self.retries = retries
+
+    def _socket(self):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((self.host, self.port))
+        return self.sock
+
+    def close(self):
+        with self.lock:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+    def _send(self, msg, payload):
+        try:
+            self._socket().send(payload)
+        except ConnectionRefusedError:
+            # ICMP port unreachable of an earlier datagram (listener was down),
+            # reported by this send: the payload was not sent, send it again
+            self.stats["refused"] += 1
+            metrics.DAQ_COMMANDS.inc(command=msg, result='refused')
+            self.logger.warning(f"DAQ listener on port {self.port} refused an earlier command, reconnecting")
+            self.sock.close()
+            self.sock = None
+            self._socket().send(payload)
+
+    def send(self, msg):
+        """
+            Send `msg`, return the ack latency in s (None without ack)
+        """
+        with self.lock:
+            if not self.ack:
+                self._send(msg, msg.encode())
+                self.stats["sent"] += 1
+                metrics.DAQ_COMMANDS.inc(command=msg, result='sent')
+                return None
+
+            req_id = next(self._ids)
+            payload = f"{msg} {req_id}".encode()
+            start = time.monotonic()
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.stats["retries"] += 1
+                    metrics.DAQ_COMMANDS.inc(command=msg, result='retried')
+                    self.logger.warning(f"No ack for '{msg}' ({req_id}) on port {self.port}, retry {attempt}/{self.retries}")
+                self._send(msg, payload)
+                self.stats["sent"] += 1
+                if self._wait_ack(self.sock, req_id):
+                    latency = time.monotonic() - start
+                    self.stats["acked"] += 1
+                    self.stats["last_latency"] = latency
+                    self.stats["total_latency"] += latency
+                    metrics.DAQ_COMMANDS.inc(command=msg, result='acked')
+                    metrics.DAQ_COMMAND_LATENCY.observe(latency, command=msg)
+                    self.logger.debug(f"'{msg}' ({req_id}) acknowledged on port {self.port} in {latency*1000:.1f} ms")
+                    return latency
+            self.stats["failed"] += 1
+            metrics.DAQ_COMMANDS.inc(command=msg, result='failed')
+            raise CommandTimeout(f"'{msg}' not acknowledged on port {self.port} after {self.retries + 1} attempts")
+
+    def _wait_ack(self, sock, req_id):
+        deadline = time.monotonic() + self.timeout
+        expected = f"ack {req_id}"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            sock.settimeout(remaining)
+            try:
+                reply = sock.recv(1024).decode(errors='replace').strip()
+            except socket.timeout:
+                return False
+            except ConnectionRefusedError:
+                # Nobody listening (ICMP port unreachable), wait for the retry
+                time.sleep(remaining)
+                return False
+            if reply == expected:
+                return True
+            # Late ack of a previous attempt or command, ignore it
+
+
+_channels = {}
+_channels_lock = threading.Lock()
+
 
-    def msg_send(self, msg):
-        self.sock.send(msg.encode())
+def get_channel(port, config=None, logger=None):
+    """
+        Shared channel of `port`, configured from the command_* keys of
+        config.yaml (read again at each call, a reloaded config applies)
+    """
+    if config is None:
+        config = config_service().data
+    with _channels_lock:
+        channel = _channels.get(port)
+        if channel is None:
+            channel = _channels[port] = CommandChannel(port, logger=logger)
+    channel.configure(host=config.get("command_host", SENDER_HOST),
+                      ack=config.get("command_ack", False),
+                      timeout=config.get("command_timeout", ACK_TIMEOUT),
+                      retries=config.get("command_retries", ACK_RETRIES))
+    return channel
@@ -1,5 +1,6 @@
 import logging
-from flask import Flask, request, jsonify
+import os
+from flask import Flask, Response, request, jsonify
 from waitress import serve
 import threading, time
 
@@ -7,25 +8,50 @@ import threading, time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-from lrsctrl.sender import Sender, SENDER_PORT_ADC64, SENDER_PORT_RC
-from lrsctrl.metadata import dump_metadata, get_afi_config
-from lrscfg.client import Client
-from lrscfg.config import Config
-from lrscfg.set_SIPMs import start_SiPMmoniotoring, stop_SiPMmoniotoring, set_SIPM
+from lrsctrl.sender import get_channel, CommandTimeout, SENDER_PORT_ADC64, SENDER_PORT_RC
+from lrsctrl.metadata import write_metadata_files, get_afi_config
+from lrsctrl.db_writer import RunsDBWriter
+from lrsctrl.scanner import DataScanner
+from lrsctrl.syncword import find_first_sync, read_header
+from lrsctrl.pipeline import FilePipeline, DISCOVERED, CLOSED, HASHED, CATALOGUED, FAILED
+from lrscfg.config import Config, config_service
+from lrscfg.set_SIPMs import start_SiPMmoniotoring, stop_SiPMmoniotoring, set_SIPM, stage_SIPM_configs
 import lrsctrl.utils as utils
-import ppulse.client as pp
+import lrsctrl.runs_catalog as runs_catalog
+import lrsctrl.metrics as metrics
+from lrsctrl.jobs import JobManager
+from lrsctrl.events import EventBus, sse_stream
+from lrsctrl.journal import RunJournal, DEFAULT_JOURNAL
+try:
+    import ppulse.client as pp
+except ImportError:  # host without the pulser software, calibration runs unavailable
+    pp = None
 import lrsctrl.pulser_config_maker as pp_config
 
-cl = Client()
 app = Flask(__name__)
 CUR_RUN = None
 CUR_RUN_LOCK = threading.Lock()
+journal = None  # RunJournal of the server process, CUR_RUN survives a restart
 FILE_PROCESS_LOCK = threading.Lock()
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 app.logger.setLevel(logging.DEBUG)
 
+# Calibration runs and pulser scans run in the background
+jobs = JobManager(app.logger)
+
+# Run and file state changes pushed to /api/events
+bus = EventBus(logger=app.logger)
+
+# Run control metrics, see /metrics
+CALIB_LIVE = metrics.counter('lrsctrl_calib_live_seconds_total', 'Calibration time with the pulser running', labels=('kind',))
+CALIB_DEAD = metrics.counter('lrsctrl_calib_dead_seconds_total', 'Calibration time spent between pulser runs', labels=('kind',))
+CALIB_SUBRUN_DEAD = metrics.histogram('lrsctrl_calib_subrun_dead_seconds', 'Dead time per calibration subrun', labels=('kind',))
+FILE_LATENCY = metrics.histogram('lrsctrl_file_catalogued_seconds', 'Time from the watcher event to the committed database row',
+                                 labels=('since',))
+FILES = metrics.counter('lrsctrl_files_total', 'Data files processed', labels=('state',))
+
 # Disable logging for watchdog
 logging.getLogger('watchdog').setLevel(logging.CRITICAL)
 
@@ -33,7 +59,9 @@ def start_app():
     server_settings = Config().parse_yaml()
     host = server_settings['AppHost']
     port = server_settings['AppPort']
-    serve(app, host=host, port=port, _quiet=False)
+    # Each /api/events client holds a thread for the duration of its stream
+    threads = server_settings.get('app_threads', 8)
+    serve(app, host=host, port=port, threads=threads, _quiet=False)
 
 
 # Log all received requests
@@ -41,193 +69,327 @@ def start_app():
 def log_request_info():
     app.logger.info(f"Received {request.method} request for {request.url}")
     if request.method == 'POST':
-        app.logger.info(f"Request data: {request.get_json()}")
+        app.logger.info(f"Request data: {request.get_json(silent=True)}")
 
 
 # Data run controls
 @app.route("/api/start_data_run/", methods=['POST'])
 def start_data_run():
-    global CUR_RUN
     data = request.get_json()
-    CUR_RUN = data
     # Pull AFI JSONs now (at run start) and store them in the current run info
     try:
         afi_jsons = get_afi_config()
         # store the dict under a single key so metadata writer can pick it up
-        CUR_RUN['afi_jsons'] = afi_jsons
+        data['afi_jsons'] = afi_jsons
     except Exception as e:
         app.logger.warning(f"Failed to load AFI configs at run start: {e}")
+    set_cur_run(data)
 
-    start_rc()
-    return jsonify(None)
+    response = start_rc()
+    if not isinstance(response, tuple):  # not an error
+        bus.publish("run.started", kind="data", run=data.get("run"), subrun=data.get("subrun"))
+    return response
 
 @app.route("/api/reset_meta/", methods=['POST'])
 def reset_meta():
-    global CUR_RUN
-    data = request.get_json()
-    CUR_RUN = data
+    set_cur_run(request.get_json())
     return jsonify(None)
 
 @app.route("/api/stop_data_run/")
 def stop_data_run():
-    stop_rc()
-    time.sleep(10)
-    app.logger.info("RUN: Run stopped")
+    try:
+        send_rc('stop_rc')
+    except CommandTimeout as e:
+        app.logger.error(f"RUN: {e}")
+        return jsonify({"error": str(e)}), 504
+    bus.publish("run.stopped", kind="data")
+    # The last file is processed as soon as the DAQ closes it (on_closed)
+    closed, waited = file_handler.wait_file_closed(file_handler.last_file_path, run_stop_timeout())
+    app.logger.info(f"RUN: Run stopped, data file {'closed' if closed else 'still growing'} after {waited:.1f} s")
     if file_handler.last_file_path:
         app.logger.debug("Start process last file")
-        with FILE_PROCESS_LOCK:
-            app.logger.debug("Lock done")
-            file_handler.process_file(file_handler.last_file_path)
+        file_handler.process_file(file_handler.last_file_path)
     app.logger.info("RUN: All files proccessed")
     return jsonify(None)
 
 
 # Calibration run controls
-@app.route("/api/start_calib_run/")
-def start_calib_run():
-    app.logger.info("CALIB: Start calib run")
-    run_info = utils.Run_Info(app)
-
-    config_dict = Config().parse_yaml()
-    app.logger.debug(f"CALIB: Set the pulser period: {config_dict['pulser_period']} ms")
-    pp.set_trig(config_dict["pulser_period"])
-
-    with CUR_RUN_LOCK:
-        global CUR_RUN
-        CUR_RUN = {
-            "run": 0,
-            "data_stream": "calibration",
-            "run_starting_instance": "lrsctrl"
-        }
+def set_calib_run_info():
+    run = {
+        "run": 0,
+        "data_stream": "calibration",
+        "run_starting_instance": "lrsctrl"
+    }
 
     app.logger.info("CALIB: Get afi config")
     try:
         afi_jsons = get_afi_config()
         # store the dict under a single key so metadata writer can pick it up
-        CUR_RUN['afi_jsons'] = afi_jsons
+        run['afi_jsons'] = afi_jsons
     except Exception as e:
         app.logger.warning(f"Failed to load AFI configs at run start: {e}")
-
-    configs_led, configs_sipmPS = utils.make_calib_files(app)
-    app.logger.info("CALIB: Pulser and SiPM config files written")
-    # app.logger.info(f"CALIB: Pulser files {configs_led}")
-    # app.logger.info(f"CALIB: sipmPS files {configs_sipmPS}")
-
-
-    # return jsonify(None)
-
-    stop_SiPMmoniotoring(logger=app.logger)
-    app.logger.info("CALIB: SiPM bias voltage monitoring stopped")
-    
-    for i, (config_led, config_sipmPS) in enumerate(zip(configs_led, configs_sipmPS)):
-        app.logger.info(f'CALIB: ~~~~~ Start calib run {i} ({i+1}/{len(configs_led)}) ~~~~~')
-
-        pp.set_channels_file(config_led)
-        app.logger.info(f'CALIB: Pulser channels set')
-        set_SIPM(config_sipmPS, manage_monitoring=False, logger=app.logger)
-        app.logger.info(f'CALIB: SiPM bias voltage channels set')
-
-        start_rc()
-        app.logger.debug(f'CALIB: ~~~ Run started ~~~')
-        time.sleep(8)
-        time.sleep(config_dict["pulser_period"])
-        pp.run_trig(config_dict["pulser_duration"])
-        app.logger.debug(f'CALIB: Pulser finished')
-        stop_rc()
-        app.logger.debug(f'CALIB: ~~~ Run stopped ~~~')
-
-        run_info.append_subrun_calib(i, config_led, config_sipmPS)
-        time.sleep(8)
-
-        # if i>2:
-        #     break
-
-    time.sleep(10)
-    start_SiPMmoniotoring(logger=app.logger)
-    app.logger.info("CALIB: SiPM bias voltage monitoring restored")
-
-    run_info.write_run_info()
-    app.logger.info('CALIB: ~~~~~~~ Run finished, run info written ~~~~~~~')
-    
+    set_cur_run(run)
+
+def run_start_timeout(config_dict=None):
+    config_dict = config_dict or Config().parse_yaml()
+    return config_dict.get("run_start_timeout", RUN_START_TIMEOUT)
+
+def run_stop_timeout(config_dict=None):
+    config_dict = config_dict or Config().parse_yaml()
+    return config_dict.get("run_stop_timeout", RUN_STOP_TIMEOUT)
+
+def start_subrun(config_dict):
+    """
+        Start the DAQ and wait for its new data file instead of a fixed delay.
+        Return (data file or None, waited s).
+    """
+    since = file_handler.created_count()
+    send_rc('start_rc')
+    data_file, waited = file_handler.wait_file_started(since, run_start_timeout(config_dict))
+    if data_file is None:
+        app.logger.warning(f"CALIB: No new data file {waited:.1f} s after start_rc, continue anyway")
+    else:
+        app.logger.debug(f"CALIB: ~~~ Run started, {data_file} written after {waited:.1f} s ~~~")
+    return data_file, waited
+
+def stop_subrun(config_dict, data_file):
+    """
+        Stop the DAQ and wait until the data file stopped growing. Return the waited s.
+    """
+    send_rc('stop_rc')
+    closed, waited = file_handler.wait_file_closed(data_file, run_stop_timeout(config_dict))
+    if not closed:
+        app.logger.warning(f"CALIB: Data file still growing {waited:.1f} s after stop_rc, continue anyway")
+    else:
+        app.logger.debug(f"CALIB: ~~~ Run stopped, data file closed after {waited:.1f} s ~~~")
+    return waited
+
+def abort_subrun():
+    """
+        Stop the DAQ after a subrun interrupted by an error
+    """
+    app.logger.warning("CALIB: Subrun interrupted, stop the DAQ")
+    try:
+        send_rc('stop_rc')
+    except Exception as e:
+        app.logger.error(f"CALIB: stop_rc failed, the DAQ may still be running: {e}")
+
+def run_pulser(config_dict):
+    """
+        Run the pulser for the subrun, return the live time in s
+    """
+    start = time.monotonic()
+    pp.run_trig(config_dict["pulser_duration"])
+    app.logger.debug(f'CALIB: Pulser finished')
+    return time.monotonic() - start
+
+def record_subrun(kind, subrun_start, live):
+    dead = time.monotonic() - subrun_start - live
+    CALIB_LIVE.inc(live, kind=kind)
+    CALIB_DEAD.inc(dead, kind=kind)
+    CALIB_SUBRUN_DEAD.observe(dead, kind=kind)
+    app.logger.info(f"CALIB: Subrun live time {live:.1f} s, dead time {dead:.1f} s")
+
+def process_last_file():
     if file_handler.last_file_path:
         app.logger.debug("Start process last file")
-        with FILE_PROCESS_LOCK:
-            file_handler.process_file(file_handler.last_file_path)
+        file_handler.process_file(file_handler.last_file_path)
         app.logger.debug("Done process last file")
-    return jsonify(None)
 
-# Calibration run controls
-@app.route("/api/start_pulser_scan/")
-def start_pulser_scan():
-    app.logger.info("CALIB: Start pulser scan")
+def run_calib(job):
+    """
+        Calibration run job: one subrun per pulser/SiPM configuration. A
+        cancellation stops the run at the next subrun boundary.
+    """
+    app.logger.info("CALIB: Start calib run")
     run_info = utils.Run_Info(app)
 
     config_dict = Config().parse_yaml()
-    app.logger.debug(f"CALIB: Set the pulser period: {config_dict['pulser_period']} ms")
-    pp.set_trig(config_dict["pulser_period"])
-
-    with CUR_RUN_LOCK:
-        global CUR_RUN
-        CUR_RUN = {
-            "run": 0,
-            "data_stream": "calibration",
-            "run_starting_instance": "lrsctrl"
-        }
-
-    app.logger.info("CALIB: Get afi config")
+    data_file = None
+    subrun_open = False
+    monitoring_stopped = False
+    # The setup steps fail like the subruns, the same cleanup applies
     try:
-        afi_jsons = get_afi_config()
-        # store the dict under a single key so metadata writer can pick it up
-        CUR_RUN['afi_jsons'] = afi_jsons
-    except Exception as e:
-        app.logger.warning(f"Failed to load AFI configs at run start: {e}")
-
-    configs_led = pp_config.make_scan_config(app.logger)
-    app.logger.info(f"CALIB: {len(configs_led)} pulser config files written")
-    # app.logger.info(f"CALIB: Pulser files {configs_led}")
-    # app.logger.info(f"CALIB: sipmPS files {configs_sipmPS}")
-
-
-    # return jsonify(None)
-
-    # stop_SiPMmoniotoring(logger=app.logger)
-    # app.logger.info("CALIB: SiPM bias voltage monitoring stopped")
-    
-    for i, config_led in enumerate(configs_led):
-        app.logger.info(f'CALIB: ~~~~~ Start pulser scan run {i} ({i+1}/{len(configs_led)}) ~~~~~')
-
-        pp.set_channels_file(config_led)
-        app.logger.info(f'CALIB: Pulser channels set')
-
-        start_rc()
-        app.logger.debug(f'CALIB: ~~~ Run started ~~~')
-        time.sleep(8)
-        time.sleep(config_dict["pulser_period"])
-        pp.run_trig(config_dict["pulser_duration"])
-        app.logger.debug(f'CALIB: Pulser finished')
-        stop_rc()
-        app.logger.debug(f'CALIB: ~~~ Run stopped ~~~')
-
-        run_info.append_subrun_pulser_scan(i, config_led)
-        time.sleep(8)
+        app.logger.debug(f"CALIB: Set the pulser period: {config_dict['pulser_period']} ms")
+        pp.set_trig(config_dict["pulser_period"])
+
+        set_calib_run_info()
+
+        configs_led, configs_sipmPS = utils.make_calib_files(app)
+        app.logger.info("CALIB: Pulser and SiPM config files written")
+        if config_dict.get("sipm_stage", True) and stage_SIPM_configs(configs_sipmPS, logger=app.logger):
+            app.logger.info("CALIB: SiPM config files staged on the supplr servers")
+        job.set_progress(0, len(configs_led))
+        bus.publish("run.started", kind=job.kind, job_id=job.id, subruns=len(configs_led))
+
+        monitoring_stopped = True
+        stop_SiPMmoniotoring(logger=app.logger)
+        app.logger.info("CALIB: SiPM bias voltage monitoring stopped")
+
+        for i, (config_led, config_sipmPS) in enumerate(zip(configs_led, configs_sipmPS)):
+            job.check_cancelled()
+            job.set_progress(i, step=f"subrun {i}")
+            subrun_start = time.monotonic()
+            app.logger.info(f'CALIB: ~~~~~ Start calib run {i} ({i+1}/{len(configs_led)}) ~~~~~')
+
+            pp.set_channels_file(config_led)
+            app.logger.info(f'CALIB: Pulser channels set')
+            set_SIPM(config_sipmPS, manage_monitoring=False, logger=app.logger)
+            app.logger.info(f'CALIB: SiPM bias voltage channels set')
+
+            subrun_open = True
+            data_file, start_wait = start_subrun(config_dict)
+            bus.publish("subrun.started", kind=job.kind, job_id=job.id, subrun=i, data_file=data_file)
+            live = run_pulser(config_dict)
+            stop_wait = stop_subrun(config_dict, data_file)
+            subrun_open = False
+
+            waits = {"run_start": round(start_wait, 3), "run_stop": round(stop_wait, 3)}
+            bus.publish("subrun.stopped", kind=job.kind, job_id=job.id, subrun=i, data_file=data_file,
+                        live=live, waits=waits)
+            run_info.append_subrun_calib(i, config_led, config_sipmPS, data_file=data_file, waits=waits)
+            record_subrun(job.kind, subrun_start, live)
+            job.set_progress(i + 1)
+    finally:
+        if subrun_open:
+            abort_subrun()
+        if data_file is not None:
+            # Normally immediate, the last file was already waited for by stop_subrun
+            file_handler.wait_file_closed(data_file, run_stop_timeout(config_dict))
+        if monitoring_stopped:
+            start_SiPMmoniotoring(logger=app.logger)
+            app.logger.info("CALIB: SiPM bias voltage monitoring restored")
+
+        run_info.write_run_info()
+        app.logger.info('CALIB: ~~~~~~~ Run finished, run info written ~~~~~~~')
+        bus.publish("run.stopped", kind=job.kind, job_id=job.id, subruns_done=job.current)
+
+        process_last_file()
+
+def run_pulser_scan(job):
+    """
+        Pulser scan job: one subrun per pulser configuration
+    """
+    app.logger.info("CALIB: Start pulser scan")
+    run_info = utils.Run_Info(app)
 
-        # if i>2:
-        #     break
+    config_dict = Config().parse_yaml()
+    data_file = None
+    subrun_open = False
+    try:
+        app.logger.debug(f"CALIB: Set the pulser period: {config_dict['pulser_period']} ms")
+        pp.set_trig(config_dict["pulser_period"])
+
+        set_calib_run_info()
+
+        configs_led = pp_config.make_scan_config(app.logger)
+        app.logger.info(f"CALIB: {len(configs_led)} pulser config files written")
+        job.set_progress(0, len(configs_led))
+        bus.publish("run.started", kind=job.kind, job_id=job.id, subruns=len(configs_led))
+
+        for i, config_led in enumerate(configs_led):
+            job.check_cancelled()
+            job.set_progress(i, step=f"subrun {i}")
+            subrun_start = time.monotonic()
+            app.logger.info(f'CALIB: ~~~~~ Start pulser scan run {i} ({i+1}/{len(configs_led)}) ~~~~~')
+
+            pp.set_channels_file(config_led)
+            app.logger.info(f'CALIB: Pulser channels set')
+
+            subrun_open = True
+            data_file, start_wait = start_subrun(config_dict)
+            bus.publish("subrun.started", kind=job.kind, job_id=job.id, subrun=i, data_file=data_file)
+            live = run_pulser(config_dict)
+            stop_wait = stop_subrun(config_dict, data_file)
+            subrun_open = False
+
+            waits = {"run_start": round(start_wait, 3), "run_stop": round(stop_wait, 3)}
+            bus.publish("subrun.stopped", kind=job.kind, job_id=job.id, subrun=i, data_file=data_file,
+                        live=live, waits=waits)
+            run_info.append_subrun_pulser_scan(i, config_led, data_file=data_file, waits=waits)
+            record_subrun(job.kind, subrun_start, live)
+            job.set_progress(i + 1)
+    finally:
+        if subrun_open:
+            abort_subrun()
+        if data_file is not None:
+            file_handler.wait_file_closed(data_file, run_stop_timeout(config_dict))
+
+        run_info.write_run_info()
+        app.logger.info('CALIB: ~~~~~~~ Run finished, run info written ~~~~~~~')
+        bus.publish("run.stopped", kind=job.kind, job_id=job.id, subruns_done=job.current)
+
+        process_last_file()
+
+def start_job(kind, func):
+    if pp is None:
+        return jsonify({"error": "ppulse is not installed on this host"}), 503
+    try:
+        job = jobs.submit(kind, func)
+    except RuntimeError as e:
+        app.logger.warning(f"JOB: {kind} not started: {e}")
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"job_id": job.id}), 202
 
-    time.sleep(10)
-    # start_SiPMmoniotoring(logger=app.logger)
-    # app.logger.info("CALIB: SiPM bias voltage monitoring restored")
+@app.route("/api/start_calib_run/")
+def start_calib_run():
+    return start_job("calib_run", run_calib)
 
-    run_info.write_run_info()
-    app.logger.info('CALIB: ~~~~~~~ Run finished, run info written ~~~~~~~')
-    
-    if file_handler.last_file_path:
-        app.logger.debug("Start process last file")
-        with FILE_PROCESS_LOCK:
-            file_handler.process_file(file_handler.last_file_path)
-        app.logger.debug("Done process last file")
-        
-    return jsonify(None)
+@app.route("/api/start_pulser_scan/")
+def start_pulser_scan():
+    return start_job("pulser_scan", run_pulser_scan)
+
+
+# Live run and file events (Server-Sent Events)
+@app.route("/api/events")
+def stream_events():
+    """
+        ?types=run,subrun,file selects event types (or prefixes). A client
+        reconnecting with Last-Event-ID first gets the events it missed.
+    """
+    types = request.args.get("types")
+    last_id = request.headers.get("Last-Event-ID", request.args.get("last_id"))
+    try:
+        last_id = int(last_id) if last_id is not None else None
+    except ValueError:
+        last_id = None
+    sub = bus.subscribe(types.split(",") if types else None, last_id)
+    return Response(sse_stream(sub), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Monitoring
+@app.route("/metrics")
+def get_metrics():
+    return metrics.REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+# Background jobs
+@app.route("/api/jobs")
+def list_jobs():
+    return jsonify(jobs.list())
+
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"job {job_id} not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/api/jobs/<job_id>/log")
+def get_job_log(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"job {job_id} not found"}), 404
+    return jsonify(job.log_since(request.args.get("since", 0, type=int)))
+
+@app.route("/api/jobs/<job_id>/cancel", methods=['POST'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"job {job_id} not found"}), 404
+    app.logger.info(f"JOB: cancellation of {job.kind} job {job.id} requested")
+    return jsonify(job.to_dict())
 
 # Calibration run controls
 @app.route("/api/start_test/")
@@ -239,62 +401,445 @@ def start_test():
     return jsonify(None)
 
 
+# Run catalog queries
+CATALOG_FILTERS = {"run": int, "subrun": int, "filename": str, "start": int, "end": int,
+                   "moas": str, "data_stream": str, "limit": int, "offset": int}
+
+def catalog_args():
+    args = {}
+    for key, cast in CATALOG_FILTERS.items():
+        if key in request.args:
+            args[key] = request.args.get(key, type=cast)
+    return args
+
+def catalog_query(func, **kwargs):
+    try:
+        conn = runs_catalog.connect(config_service().require_str("db_path"))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+    try:
+        return jsonify(func(conn, **catalog_args(), **kwargs))
+    except Exception as e:
+        app.logger.warning(f"Run catalog query failed: {e}")
+        return jsonify({"error": str(e)}), 400
+    finally:
+        conn.close()
+
+@app.route("/api/runs")
+def get_runs():
+    by_subrun = request.args.get("by") == "subrun"
+    return catalog_query(runs_catalog.summarize_runs, by_subrun=by_subrun)
+
+@app.route("/api/runs/<int:run>")
+def get_run(run):
+    request_args = catalog_args()
+    request_args.pop("run", None)
+    try:
+        conn = runs_catalog.connect(config_service().require_str("db_path"))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+    try:
+        total = runs_catalog.summarize_runs(conn, run=run)["items"]
+        subruns = runs_catalog.summarize_runs(conn, by_subrun=True, run=run, **request_args)
+        # ?afi=1: the AFI JSONs of the run, decoded from afi_configs
+        afi = runs_catalog.run_afi(conn, run) if request.args.get("afi", type=int) else None
+    except Exception as e:
+        app.logger.warning(f"Run catalog query failed: {e}")
+        return jsonify({"error": str(e)}), 400
+    finally:
+        conn.close()
+    if not total:
+        return jsonify({"error": f"run {run} not found"}), 404
+    result = {"run": total[0], **subruns}
+    if afi is not None:
+        result["afi"] = afi
+    return jsonify(result)
+
+@app.route("/api/runs/files")
+def get_run_files():
+    return catalog_query(runs_catalog.query_files)
+
+
 # DAQ software controls
+def send_command(port, msg):
+    """
+        Send a command to a DAQ listener, raise CommandTimeout if it is not acknowledged
+    """
+    latency = get_channel(port, logger=app.logger).send(msg)
+    if latency is not None:
+        app.logger.info(f"DAQ: {msg} acknowledged in {latency*1000:.1f} ms")
+    return latency
+
+def send_rc(msg):
+    return send_command(SENDER_PORT_RC, msg)
+
+def command_response(port, msg):
+    try:
+        latency = send_command(port, msg)
+    except CommandTimeout as e:
+        app.logger.error(f"DAQ: {e}")
+        return jsonify({"error": str(e)}), 504
+    return jsonify(None if latency is None else {"latency": latency})
+
+
 @app.route("/api/start_adc64/")
 def start_adc64():
-    Sender(SENDER_PORT_ADC64).msg_send('start_adc64')
-    return jsonify(None)
+    return command_response(SENDER_PORT_ADC64, 'start_adc64')
 
 
 @app.route("/api/stop_adc64/")
 def stop_adc64():
-    Sender(SENDER_PORT_ADC64).msg_send('stop_adc64')
-    return jsonify(None)
+    return command_response(SENDER_PORT_ADC64, 'stop_adc64')
 
 
 @app.route("/api/start_rc/")
 def start_rc():
-    Sender(SENDER_PORT_RC).msg_send('start_rc')
-    return jsonify(None)
+    return command_response(SENDER_PORT_RC, 'start_rc')
 
 
 @app.route("/api/stop_rc/")
 def stop_rc():
-    Sender(SENDER_PORT_RC).msg_send('stop_rc')
-    return jsonify(None)
+    return command_response(SENDER_PORT_RC, 'stop_rc')
+
+
+# Minimum growth before a followed file is scanned again
+TAIL_MIN_BYTES = 4 * 1024 * 1024
+# Run transitions: a file is finished once the DAQ closed it or, where close
+# events are not reported, once it stopped growing for FILE_IDLE_TIME s. The
+# waits fall back to a timeout when no file shows up
+FILE_IDLE_TIME = 2
+RUN_START_TIMEOUT = 15
+RUN_STOP_TIMEOUT = 10
+WAIT_POLL = 0.5 # s, the file size is also polled in case an event is missed
+PROCESS_TIMEOUT = 60 # s for the checksum and database commit of a closed file
+
+
+def first_event(path):
+    """
+        (unix_ms, tai_s) of the first event header of `path`, None if it holds none yet
+    """
+    try:
+        with open(path, 'rb') as f:
+            offset = find_first_sync(f)
+            return None if offset is None else read_header(f, offset)
+    except (FileNotFoundError, ValueError):
+        return None
 
 
 class FileHandler(FileSystemEventHandler):
     def __init__(self):
         super().__init__()
         self.last_file_path = None
+        # Tail-follow: checksum and events of the files being written are
+        # computed as they grow, so closing a file only reads its last bytes
+        config = config_service()
+        self.scanners = {}
+        self.tail_pending = set()
+        self.tail_lock = threading.Lock()
+        # Closed files are processed by worker threads, not the watcher thread
+        self.pipeline = FilePipeline(self.process_job,
+                                     n_workers=config.get_int("file_workers", 2),
+                                     queue_size=config.get_int("file_queue_size", 16),
+                                     logger=app.logger,
+                                     listener=self.on_state)
+        self.db_writer = RunsDBWriter(config.require_str("db_path"), logger=app.logger)
+        metrics.gauge('lrsctrl_file_queue_depth', 'Closed data files waiting for a worker',
+                      func=self.pipeline.queue_depth)
+        # Run transitions wait on the file events instead of fixed sleeps
+        self.file_event = threading.Condition()
+        self.n_created = 0
+        self.newest_file = None
+        self.last_activity = {}
+        self.closed = {}
+
+    # Read at each use, a config.yaml reload applies to the next file
+    @property
+    def tail_follow(self):
+        return config_service().get_bool("tail_follow", True)
+
+    @property
+    def idle_time(self):
+        return config_service().get_float("file_idle_time", FILE_IDLE_TIME)
+
+    @property
+    def close_timeout(self):
+        return config_service().get_float("run_stop_timeout", RUN_STOP_TIMEOUT)
+
+    def start(self):
+        self.db_writer.start()
+        self.pipeline.start()
+
+    def on_modified(self, event):
+        if event.is_directory or not event.src_path.endswith('.data'):
+            return
+        with self.file_event:
+            self.last_activity[event.src_path] = time.monotonic()
+            self.closed.pop(event.src_path, None)  # reopened for writing
+            self.file_event.notify_all()
+        try:
+            self.reopen(event.src_path, os.stat(event.src_path).st_size)
+        except FileNotFoundError:
+            pass
+        if not self.tail_follow:
+            return
+        # Hashing is slow, the observer thread only hands it to the file's worker
+        with self.tail_lock:
+            if event.src_path in self.tail_pending:
+                return
+            self.tail_pending.add(event.src_path)
+        if not self.pipeline.post(event.src_path, lambda: self.scan_tail(event.src_path)):
+            with self.tail_lock:
+                self.tail_pending.discard(event.src_path)
+
+    def scan_tail(self, file_path):
+        """
+            Checksum the new part of `file_path` while it is written (worker thread)
+        """
+        with self.tail_lock:
+            self.tail_pending.discard(file_path)
+            if self.pipeline.state(file_path) not in (None, DISCOVERED):
+                return  # already closed, the worker processing it took the scanner
+            scanner = self.scanners.get(file_path)
+            try:
+                size = os.stat(file_path).st_size
+            except FileNotFoundError:
+                self.scanners.pop(file_path, None)
+                return
+            if scanner is None or size < scanner.size:
+                # New or rewritten file, (re)start from the beginning
+                scanner = self.scanners[file_path] = DataScanner(collect_events=True)
+            if size - scanner.size >= TAIL_MIN_BYTES:
+                scanner.scan_file(file_path)
+
+    def on_closed(self, event):
+        if event.is_directory or not event.src_path.endswith('.data'):
+            return
+        app.logger.debug(f"File closed {event.src_path}")
+        with self.file_event:
+            self.closed[event.src_path] = time.monotonic()
+            self.file_event.notify_all()
+        # Processed now rather than when the next file appears or the run stops
+        self.pipeline.submit(event.src_path, run_args())
+
+    def reopen(self, file_path, size, worker=False):
+        """
+            Process again a file written after it was processed (partial content).
+            worker: called from a file worker, which must not block on its own queue
+        """
+        if self.pipeline.reopen(file_path, size) is None:
+            return
+        app.logger.warning(f"File {file_path} written again after it was processed, processed again")
+        with self.file_event:
+            closed = file_path in self.closed
+        if closed:
+            # Closed again while it was processed, no close event will follow
+            if worker:
+                # The file goes back to this worker's queue, it may be full
+                threading.Thread(target=self.pipeline.submit, args=(file_path, None),
+                                 name='file-resubmit', daemon=True).start()
+            else:
+                self.pipeline.submit(file_path, None)
+
+    def pop_scanner(self, file_path):
+        """
+            Detach the tail-follow scanner of `file_path`, waiting for a scan in progress
+        """
+        with self.tail_lock:
+            scanner = self.scanners.pop(str(file_path), None)
+        if scanner is not None:
+            try:
+                if os.stat(file_path).st_size < scanner.size:
+                    return None
+            except FileNotFoundError:
+                return None
+        return scanner
 
     def on_created(self, event):
         if not event.is_directory and event.src_path.endswith('.data'):
             app.logger.debug(f"New file discoverd {event.src_path}")
+            with self.file_event:
+                self.n_created += 1
+                self.newest_file = event.src_path
+                self.last_activity[event.src_path] = time.monotonic()
+                self.file_event.notify_all()
             with FILE_PROCESS_LOCK:
                 if self.last_file_path:  # Check if there was a previous file
-                    self.process_file(self.last_file_path)  # Process the previous file
+                    self.pipeline.submit(self.last_file_path, run_args())  # Queue the previous file
                 self.last_file_path = event.src_path
-
-    def process_file(self, file_path):
-        global CUR_RUN
-        app.logger.info(f"Process file {file_path}")
-        #app.logger.debug(CUR_RUN)
-        if CUR_RUN:
-            meta_args = CUR_RUN
-            meta_args["database"] = Config().parse_yaml()["db_path"]
-            meta_args["datafile"] = str(file_path)
-            dump_metadata(app, meta_args) #also adds entry to LRS runs database
-            app.logger.debug("Dump metadata done")
-            self.last_file_path = None
+                self.pipeline.discover(event.src_path)
+
+    def created_count(self):
+        """
+            Number of .data files seen so far, to pass to wait_file_started()
+        """
+        with self.file_event:
+            return self.n_created
+
+    def wait_file_started(self, since, timeout=RUN_START_TIMEOUT):
+        """
+            Wait until a .data file created after `since` (created_count())
+            holds a complete event header. Return (path, waited s), path is
+            None if the timeout expired.
+        """
+        start = time.monotonic()
+        with self.file_event:
+            while True:
+                waited = time.monotonic() - start
+                if self.n_created > since and first_event(self.newest_file) is not None:
+                    return self.newest_file, waited
+                if waited >= timeout:
+                    return None, waited
+                self.file_event.wait(min(timeout - waited, WAIT_POLL))
+
+    def wait_file_closed(self, file_path, timeout=RUN_STOP_TIMEOUT):
+        """
+            Wait until the DAQ closed `file_path` (inotify IN_CLOSE_WRITE) or,
+            where close events are not reported, until it stopped growing for
+            idle_time s. Without a file, wait for the full timeout.
+            Return (closed, waited s).
+        """
+        start = time.monotonic()
+        if file_path is None:
+            time.sleep(timeout)
+            return False, time.monotonic() - start
+        file_path = str(file_path)
+        size = None
+        last = None
+        with self.file_event:
+            while True:
+                now = time.monotonic()
+                if file_path in self.closed:
+                    return True, now - start
+                try:
+                    st = os.stat(file_path)
+                except FileNotFoundError:
+                    st = None
+                cur_size = st.st_size if st else None
+                if last is None:
+                    # A file last written long ago is already idle
+                    last = now - (max(0.0, time.time() - st.st_mtime) if st else 0.0)
+                elif cur_size != size:
+                    last = now
+                size = cur_size
+                last = max(last, self.last_activity.get(file_path, last))
+                if now - last >= self.idle_time:
+                    return True, now - start
+                if now - start >= timeout:
+                    return False, now - start
+                self.file_event.wait(min(self.idle_time - (now - last), timeout - (now - start), WAIT_POLL))
+
+    def process_file(self, file_path, timeout=None):
+        """
+            Queue `file_path` for processing and wait until it is done, at most
+            `timeout` s (default: run_stop_timeout + PROCESS_TIMEOUT). The lock
+            is only held to queue it, the watcher goes on during the wait.
+        """
+        file_path = str(file_path)
+        if timeout is None:
+            timeout = self.close_timeout + PROCESS_TIMEOUT
+        with FILE_PROCESS_LOCK:
+            self.pipeline.submit(file_path, run_args())
+        job = self.pipeline.wait(file_path, timeout)
+        if job is None or not job.done.is_set():
+            app.logger.warning(f"File {file_path} not processed after {timeout:.0f} s, left to the workers")
+        elif job.state == CATALOGUED:
+            with FILE_PROCESS_LOCK:
+                if self.last_file_path == file_path:
+                    self.last_file_path = None
+        return job
+
+    def process_job(self, job):
+        app.logger.info(f"Process file {job.path}")
+        # Never checksum a file the DAQ is still writing
+        closed, waited = self.wait_file_closed(job.path, self.close_timeout)
+        if not closed:
+            app.logger.warning(f"File {job.path} still growing after {waited:.0f} s, processed anyway")
+        with self.file_event:
+            self.last_activity.pop(job.path, None)
+            self.closed.pop(job.path, None)
+        scanner = self.pop_scanner(job.path)
+        # Copied, job.args stays the run snapshot the journal refers to
+        meta_args = dict(job.args) if job.args else None
+        if not meta_args:
+            app.logger.warning("NO RUN INFO for file %s, metadata not created", job.path)
+            job.advance(FAILED, "no run info")
+            FILES.inc(state=FAILED)
+            return
+        meta_args["database"] = config_service().get_str("db_path")
+        meta_args["datafile"] = job.path
+        cache_rows = []
+        meta = write_metadata_files(app, meta_args, scanner=scanner, cache_rows=cache_rows)
+        job.size = meta['size']
+        job.advance(HASHED)
+        # The row is committed by the writer thread, the worker moves on
+        future = self.db_writer.submit(meta, meta_args, cache_rows, replace=job.replaces)
+        future.add_done_callback(lambda f: self.on_catalogued(job, f))
+        size = os.path.getsize(job.path)
+        if size != meta['size']:
+            app.logger.warning(f"File {job.path} changed while it was processed, metadata size {meta['size']}")
+            self.reopen(job.path, size, worker=True)
+
+    @staticmethod
+    def on_state(job):
+        bus.publish(f"file.{job.state}", path=job.path, run_key=job.run_key, error=job.error)
+        if journal is not None and job.state != HASHED:
+            journal.record_file(job.path, job.state, job.args)
+
+    def restore(self, pending):
+        """
+            Resume the files left by the previous server process, `pending`
+            as returned by RunJournal.replay()
+        """
+        for path, state, run in pending:
+            if state == DISCOVERED and not self.wait_file_closed(path, 0)[0]:
+                # Probably still written by the DAQ: processed when it is closed
+                self.last_file_path = path
+                self.pipeline.discover(path)
+            else:
+                app.logger.info(f"Resume processing of {path}")
+                self.pipeline.submit(path, dict(run) if run else None)
+
+    def on_catalogued(self, job, future):
+        if future.exception() is not None:
+            app.logger.error(f"Database insert failed for {job.path}: {future.exception()}")
+            job.advance(FAILED, future.exception())
+            FILES.inc(state=FAILED)
         else:
-            app.logger.warning("NO RUN INFO for file %s, metadata not created", str(self.last_file_path))
+            job.advance(CATALOGUED)
+            FILES.inc(state=CATALOGUED)
+            for since in (DISCOVERED, CLOSED):
+                if since in job.times:
+                    FILE_LATENCY.observe(job.times[CATALOGUED] - job.times[since], since=since)
+            app.logger.debug(f"Dump metadata done for {job.path}")
+
+
+def set_cur_run(run):
+    """
+        Replace the current run info and record it in the journal
+    """
+    global CUR_RUN
+    with CUR_RUN_LOCK:
+        CUR_RUN = run
+        # Before any file can be queued with it (queued, not written here)
+        if journal is not None:
+            journal.record_run(run)
+
+
+def run_args():
+    """
+        Snapshot of the current run info attached to a file when it is queued
+    """
+    with CUR_RUN_LOCK:
+        return dict(CUR_RUN) if CUR_RUN else None
 
 
-def watch_for_new_files(directory, event_handler):
+def watch_for_new_files(directories, event_handler):
     observer = Observer()
-    observer.schedule(event_handler, directory, recursive=True)
+    for directory in directories:
+        observer.schedule(event_handler, directory, recursive=True)
+    # config.yaml edits apply without restarting the server, except the
+    # watched directories, db_path and the file worker pool
+    config_service().watch(observer)
     observer.start()
     try:
         while True:
@@ -305,9 +850,21 @@ def watch_for_new_files(directory, event_handler):
 
 
 if __name__ == "__main__":
-    directory_to_watch = Config().parse_yaml()["data_path"]
+    config = config_service()
+    # The calibration files are watched too, the calib runs wait on their events
+    directories_to_watch = [config.get_str("data_path")]
+    calib_data = config.get_str("calib_data")
+    data_root = os.path.abspath(directories_to_watch[0])
+    if calib_data and os.path.commonpath([data_root, os.path.abspath(calib_data)]) != data_root:
+        directories_to_watch.append(calib_data)
+    journal = RunJournal(config.get_str("journal_path") or
+                         os.path.join(os.path.dirname(config.require_str("db_path")), DEFAULT_JOURNAL), app.logger)
+    CUR_RUN, pending = journal.replay()
+    app.logger.info(f"Journal {journal.path} replayed: run {CUR_RUN and CUR_RUN.get('run')}, {len(pending)} files pending")
     file_handler = FileHandler()
-    watcher_thread = threading.Thread(target=watch_for_new_files, args=(directory_to_watch, file_handler))
+    file_handler.start()
+    file_handler.restore(pending)
+    watcher_thread = threading.Thread(target=watch_for_new_files, args=(directories_to_watch, file_handler))
     watcher_thread.daemon = True
     watcher_thread.start()
     start_app()
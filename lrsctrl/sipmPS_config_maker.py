@@ -6,7 +6,7 @@ import os
 import shutil
 
 from lrscfg.config import Config
-from lrscfg.client import Client
+from lrscfg.versions import get_resolver
 
 def map_ledRun_id():
     led_id_map = {}
@@ -30,8 +30,7 @@ def map_ledRun_id():
 
 
 def map_ledRun_PSsipm(led_id_map):
-    cl = Client()
-    filename = cl.get_active_moas()
+    filename = get_resolver().active_moas()
 	# print(filename, Config().parse_yaml()["moas_path"])
     path_moas = os.path.join(Config().parse_yaml()["moas_path"],filename)
     # Load MOAS
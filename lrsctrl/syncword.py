@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+
+SYNC_WORD = 0x2A50D5AF
+SYNC_BYTES = SYNC_WORD.to_bytes(4, 'little')
+# Event header layout, relative to the sync word:
+#   +0  sync word (u4), +12 unix timestamp in us (u8), +32 TAI seconds (u4)
+TIMESTAMP_OFFSET = 12
+TAI_OFFSET = 32
+EVENT_HEADER_SIZE = TAI_OFFSET + 4
+
+SEARCH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def find_sync(data, sync=SYNC_BYTES):
+    """
+        Return the byte positions of every sync word in the bytes-like `data`,
+        whatever its alignment. The search is vectorized: candidates are the
+        positions of the first byte, then checked against the three others.
+    """
+    a = np.frombuffer(data, dtype=np.uint8)
+    if len(a) < len(sync):
+        return np.empty(0, dtype=np.int64)
+    n = len(a) - len(sync) + 1
+    pos = np.flatnonzero(a[:n] == sync[0])
+    for i in range(1, len(sync)):
+        if not len(pos):
+            break
+        pos = pos[a[pos + i] == sync[i]]
+    return pos
+
+
+def find_first_sync(f, start=0, end=None, min_tail=EVENT_HEADER_SIZE, chunk_size=SEARCH_CHUNK_SIZE):
+    """
+        Forward search of the binary file object `f` for the first sync word at
+        an offset >= start followed by at least `min_tail` bytes before `end`
+        (default: end of file). Chunks overlap so words crossing a chunk
+        boundary are found. Return the file offset or None.
+    """
+    if chunk_size < len(SYNC_BYTES):
+        raise ValueError(f"chunk_size must be at least the sync word size, got {chunk_size}")
+    if end is None:
+        end = os.fstat(f.fileno()).st_size
+    overlap = len(SYNC_BYTES) - 1
+    last_start = end - min_tail  # last admissible sync offset
+    offset = start
+    while offset <= last_start:
+        f.seek(offset)
+        data = f.read(min(chunk_size, end - offset))
+        pos = find_sync(data)
+        pos = pos[pos + offset <= last_start]
+        if len(pos):
+            return offset + int(pos[0])
+        if len(data) <= overlap:
+            break
+        offset += len(data) - overlap
+    return None
+
+
+def find_last_sync(f, start=0, end=None, min_tail=EVENT_HEADER_SIZE, chunk_size=SEARCH_CHUNK_SIZE):
+    """
+        Backward counterpart of find_first_sync: the last sync word at an offset
+        >= start that is followed by at least `min_tail` bytes before `end`.
+        Return the file offset or None.
+    """
+    if chunk_size < len(SYNC_BYTES):
+        raise ValueError(f"chunk_size must be at least the sync word size, got {chunk_size}")
+    if end is None:
+        end = os.fstat(f.fileno()).st_size
+    overlap = len(SYNC_BYTES) - 1
+    last_start = end - min_tail
+    stop = min(end, last_start + len(SYNC_BYTES))  # no admissible word ends after this
+    while stop - start >= len(SYNC_BYTES):
+        offset = max(start, stop - chunk_size)
+        f.seek(offset)
+        data = f.read(stop - offset)
+        pos = find_sync(data)
+        if len(pos):
+            return offset + int(pos[-1])
+        if offset == start:
+            break
+        stop = offset + overlap
+    return None
+
+
+def decode_header(data, pos):
+    """
+        Decode the event header starting at index `pos` of the uint8 array
+        `data`. Return (unix_ms, tai_s).
+    """
+    pos = int(pos)
+    ts = data[pos + TIMESTAMP_OFFSET:pos + TIMESTAMP_OFFSET + 8].view('<u8')[0]
+    tai = data[pos + TAI_OFFSET:pos + TAI_OFFSET + 4].view('<u4')[0]
+    return int(ts) // 1000, int(tai)
+
+
+def decode_headers(data, pos):
+    """
+        Vectorized decode_header for an array of positions `pos`.
+        Return (unix_ms, tai_s) arrays.
+    """
+    pos = np.asarray(pos, dtype=np.int64)[:, None]
+    ts = data[pos + TIMESTAMP_OFFSET + np.arange(8)].reshape(-1).view('<u8')
+    tai = data[pos + TAI_OFFSET + np.arange(4)].reshape(-1).view('<u4')
+    return ts // 1000, tai
+
+
+def read_header(f, offset):
+    """
+        Read and decode the event header at file offset `offset` of `f`.
+        Return (unix_ms, tai_s).
+    """
+    f.seek(offset)
+    data = f.read(EVENT_HEADER_SIZE)
+    if len(data) < EVENT_HEADER_SIZE:
+        raise ValueError(f"File ended unexpectedly while reading the event header at {offset}")
+    return decode_header(np.frombuffer(data, dtype=np.uint8), 0)
@@ -7,7 +7,7 @@ from datetime import datetime
 
 import  lrsctrl.pulser_config_maker
 import  lrsctrl.sipmPS_config_maker
-from lrscfg.client import Client
+from lrscfg.versions import get_resolver
 from lrscfg.config import Config
 
 
@@ -138,7 +138,7 @@ class Run_Info:
         self.config = Config().parse_yaml()
         self.run_folder = os.path.abspath(self.config["calib_data"])
         
-        moas = Client().get_active_moas()
+        moas = get_resolver().active_moas()
         self.moas = os.path.join(self.config["moas_path"],moas)
 
         self.subruns = []
@@ -195,27 +195,31 @@ class Run_Info:
 
         return adc_active_chans
 
-    def append_subrun_calib(self, subrun_number, pulser_config, sipmPS_config):
+    def append_subrun_calib(self, subrun_number, pulser_config, sipmPS_config, data_file=None, waits=None):
         self.logger.debug(f"Append subrun {subrun_number} to the run info")
         subrun_info = {
             "subrun" : subrun_number,
-            "data_file" : get_most_recent_file(self.run_folder),
+            "data_file" : data_file or get_most_recent_file(self.run_folder),
             "pulser_config" : pulser_config,
             "sipmPS_config" : sipmPS_config,
             "active_chans" : self.get_active_chans(sipmPS_config)
         }
+        if waits is not None:
+            subrun_info["waits"] = waits
         
         self.subruns.append(subrun_info)
 
         return 0
     
-    def append_subrun_pulser_scan(self, subrun_number, pulser_config):
+    def append_subrun_pulser_scan(self, subrun_number, pulser_config, data_file=None, waits=None):
         self.logger.debug(f"Append subrun {subrun_number} to the run info")
         subrun_info = {
             "subrun" : subrun_number,
-            "data_file" : get_most_recent_file(self.run_folder),
+            "data_file" : data_file or get_most_recent_file(self.run_folder),
             "pulser_config" : pulser_config,
         }
+        if waits is not None:
+            subrun_info["waits"] = waits
         
         self.subruns.append(subrun_info)
 
@@ -0,0 +1,52 @@
+"""
+    Stand-in for the DAQ RunControl/ADC64 listeners, to test lrsctrl without
+    the DAQ. Prints the received commands and acknowledges the ones sent
+    with a request id ("start_rc 42" -> "ack 42").
+
+    python test/fake_daq_listener.py [--no-ack] [--drop 0.3] [--delay 0.05]
+"""
+import argparse
+import random
+import socket
+import threading
+import time
+
+from lrsctrl.sender import SENDER_HOST, SENDER_PORT_ADC64, SENDER_PORT_RC
+
+
+def listen(port, ack=True, drop=0.0, delay=0.0):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((SENDER_HOST, port))
+    seen = set()
+    print(f"Listening on {SENDER_HOST}:{port}")
+    while True:
+        data, addr = sock.recvfrom(1024)
+        parts = data.decode(errors='replace').split()
+        if not parts:
+            continue
+        cmd, req_id = parts[0], parts[1] if len(parts) > 1 else None
+        if req_id is not None and random.random() < drop:
+            print(f"[{port}] {cmd} ({req_id}) dropped")
+            continue
+        duplicate = req_id is not None and req_id in seen
+        print(f"[{port}] {cmd}" + (f" ({req_id})" if req_id else "") + (" duplicate" if duplicate else ""))
+        if req_id is None or not ack:
+            continue
+        seen.add(req_id)
+        time.sleep(delay)
+        sock.sendto(f"ack {req_id}".encode(), addr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--no-ack', action='store_true', help='behave like the legacy listeners')
+    parser.add_argument('--drop', type=float, default=0.0, help='fraction of commands to ignore')
+    parser.add_argument('--delay', type=float, default=0.0, help='s before acknowledging')
+    args = parser.parse_args()
+    for port in (SENDER_PORT_ADC64, SENDER_PORT_RC):
+        threading.Thread(target=listen, args=(port, not args.no_ack, args.drop, args.delay), daemon=True).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
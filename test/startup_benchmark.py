@@ -0,0 +1,64 @@
+"""
+    Startup time of the lrsctrl/lrscfg command line tools.
+
+    Imports each CLI module in a fresh interpreter, prints the median wall
+    time and fails (exit code 1) if it exceeds the budget or if one of the
+    heavy server-side modules got imported.
+
+    python test/startup_benchmark.py [--runs 5] [--budget-ms 300]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLI_MODULES = ['lrsctrl.cli', 'lrscfg.cli']
+
+# Only needed by the server or by the commands driving the hardware
+HEAVY_MODULES = ['flask', 'waitress', 'watchdog', 'pandas', 'numpy', 'h5py', 'ppulse',
+                 'prettytable', 'lrsctrl.server', 'lrscfg.set_SIPMs', 'lrscfg.set_VGAS']
+
+
+def run_python(code):
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code], cwd=REPO, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return time.perf_counter() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=300)
+    args = parser.parse_args()
+
+    baseline = statistics.median(run_python('pass')[0] for _ in range(args.runs))
+    print(f"{'python -c pass':<16} {baseline*1000:7.1f} ms")
+
+    failed = False
+    for module in CLI_MODULES:
+        times = []
+        for _ in range(args.runs):
+            elapsed, out = run_python(
+                f"import sys; import {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+            times.append(elapsed)
+        median = statistics.median(times)
+        heavy = out.split()
+        status = 'ok'
+        if median * 1000 > args.budget_ms:
+            status = f'too slow (budget {args.budget_ms:.0f} ms)'
+            failed = True
+        if heavy:
+            status = f'imports {", ".join(heavy)}'
+            failed = True
+        print(f"{module:<16} {median*1000:7.1f} ms  {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
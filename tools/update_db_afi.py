@@ -15,6 +15,12 @@ Usage examples:
   # dry-run (shows what would be updated)
   python3 tools/update_db_afi.py --db /path/to/lrsdb.db --filenames x.data --dry-run
 
+  # move the AFI JSONs stored inline in old rows to the afi_configs table
+  python3 tools/update_db_afi.py --db /path/to/lrsdb.db --migrate [--vacuum]
+
+The AFI JSONs are stored once per content in the `afi_configs` table (keyed by
+the sha256 of the JSON) and rows only hold the hash in the afi_*_ref columns.
+
 This script uses the repository's `get_afi_config()` function to load the AFI JSONs based
 on current configuration. Run this script from the repository root or pass a full path
 for --db. Ensure your PYTHONPATH or sys.path includes the repo root. If you use the
@@ -25,13 +31,15 @@ import argparse
 import sys
 import sqlite3
 import json
+import warnings
 from pathlib import Path
 
 # Ensure repo root is importable
 REPO_ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(REPO_ROOT))
 
-from lrsctrl.metadata import get_afi_config
+from lrsctrl.metadata import get_afi_config, afi_blob, create_runs_table, AFI_COLUMNS, INSERT_AFI_CONFIG, \
+    RUNS_DATA_INDEXES
 
 
 def parse_list_arg(s):
@@ -40,12 +48,69 @@ def parse_list_arg(s):
     return [x.strip() for x in s.split(',') if x.strip()]
 
 
-def ensure_columns(cursor):
-    cursor.execute("PRAGMA table_info(lrs_runs_data)")
-    cols = [r[1] for r in cursor.fetchall()]
-    needed = ['afi_runcontrol_json', 'afi_evb_json', 'afi_adc64_sum_json', 'afi_adc64_reg_json']
-    missing = [c for c in needed if c not in cols]
-    return missing
+def schema_changes(cursor):
+    """
+        Columns, tables and indexes create_runs_table() would add, read only
+    """
+    cursor.execute("PRAGMA table_info('lrs_runs_data')")
+    columns = {row[1] for row in cursor.fetchall()}
+    changes = [f"column lrs_runs_data.{ref}" for _, ref in AFI_COLUMNS.values() if ref not in columns]
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")
+    names = {row[0] for row in cursor.fetchall()}
+    if 'afi_configs' not in names:
+        changes.append("table afi_configs")
+    for index in RUNS_DATA_INDEXES:
+        name = index.split(' ON ')[0].split()[-1]
+        if name not in names:
+            changes.append(f"index {name}")
+    return changes
+
+
+def ensure_columns(cursor, dry_run=False):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='lrs_runs_data'")
+    if not cursor.fetchone():
+        return ['lrs_runs_data']
+    if dry_run:
+        # DDL is committed immediately, only report it
+        changes = schema_changes(cursor)
+        if changes:
+            print('Schema changes that would be applied:', ', '.join(changes))
+        return []
+    # Adds the afi_*_ref columns and the afi_configs table if needed
+    create_runs_table(cursor)
+    return []
+
+
+def migrate(conn, dry_run=False, vacuum=False):
+    """
+        Move the inline afi_*_json columns to afi_configs. The work is done
+        per distinct JSON text (a handful per DB) rather than per row.
+    """
+    cur = conn.cursor()
+    n_blobs = n_rows = 0
+    for json_col, ref_col in AFI_COLUMNS.values():
+        cur.execute(f"SELECT DISTINCT {json_col} FROM lrs_runs_data WHERE {json_col} IS NOT NULL")
+        texts = [r[0] for r in cur.fetchall()]
+        print(f"{json_col}: {len(texts)} distinct JSONs")
+        for text in texts:
+            blob = afi_blob(json.loads(text))
+            if dry_run:
+                cur.execute(f"SELECT COUNT(*) FROM lrs_runs_data WHERE {json_col} = ?", (text,))
+                n_rows += cur.fetchone()[0]
+                continue
+            cur.execute(INSERT_AFI_CONFIG, blob)
+            n_blobs += cur.rowcount
+            cur.execute(f"UPDATE lrs_runs_data SET {ref_col} = ?, {json_col} = NULL WHERE {json_col} = ?",
+                        (blob[0], text))
+            n_rows += cur.rowcount
+    if dry_run:
+        print(f"\nDry run; {n_rows} row references would be migrated.")
+        return
+    conn.commit()
+    print(f"Migration completed: {n_blobs} new afi_configs entries, {n_rows} row references updated.")
+    if vacuum:
+        print("Vacuum database...")
+        conn.execute("VACUUM")
 
 
 def main():
@@ -59,6 +124,8 @@ def main():
     ap.add_argument('--afi-adc64-sum', help='Path to an Adc64 sum AFI JSON file to use')
     ap.add_argument('--afi-adc64-reg', help='Path to an Adc64 reg AFI JSON file to use')
     ap.add_argument('--dry-run', action='store_true', help='Show rows to be updated but do not write')
+    ap.add_argument('--migrate', action='store_true', help='Move the inline AFI JSON columns to the afi_configs table')
+    ap.add_argument('--vacuum', action='store_true', help='With --migrate, reclaim the freed space afterwards')
     args = ap.parse_args()
 
     db_path = Path(args.db).expanduser().resolve()
@@ -66,6 +133,17 @@ def main():
         print(f"DB not found: {db_path}")
         raise SystemExit(1)
 
+    if args.migrate:
+        conn = sqlite3.connect(str(db_path))
+        missing = ensure_columns(conn.cursor(), dry_run=args.dry_run)
+        if missing:
+            print('The database is missing expected tables:', missing)
+            conn.close()
+            raise SystemExit(3)
+        migrate(conn, dry_run=args.dry_run, vacuum=args.vacuum)
+        conn.close()
+        return
+
     filenames = parse_list_arg(args.filenames)
     runs = parse_list_arg(args.runs)
 
@@ -134,18 +212,18 @@ def main():
             if k in cfg_dict:
                 afi_dict[k] = cfg_dict[k]
 
-    afi_runcontrol = json.dumps(afi_dict.get('RunControl')) if 'RunControl' in afi_dict else None
-    afi_evb = json.dumps(afi_dict.get('EvB')) if 'EvB' in afi_dict else None
-    afi_adc64_sum = json.dumps(afi_dict.get('Adc64_sum')) if 'Adc64_sum' in afi_dict else None
-    afi_adc64_reg = json.dumps(afi_dict.get('Adc64_reg')) if 'Adc64_reg' in afi_dict else None
+    afi = {key: afi_blob(afi_dict[key]) for key in AFI_COLUMNS if key in afi_dict}
+    afi_runcontrol = afi['RunControl'][0] if 'RunControl' in afi else None
+    afi_evb = afi['EvB'][0] if 'EvB' in afi else None
+    afi_adc64_sum = afi['Adc64_sum'][0] if 'Adc64_sum' in afi else None
+    afi_adc64_reg = afi['Adc64_reg'][0] if 'Adc64_reg' in afi else None
 
     conn = sqlite3.connect(str(db_path))
     cur = conn.cursor()
 
-    missing = ensure_columns(cur)
+    missing = ensure_columns(cur, dry_run=args.dry_run)
     if missing:
-        print('The database is missing expected columns:', missing)
-        print('Please migrate the database or ensure the table has the new JSON columns.')
+        print('The database is missing expected tables:', missing)
         conn.close()
         raise SystemExit(3)
 
@@ -182,17 +260,15 @@ def main():
         conn.close()
         return
 
-    update_sql = (
-        'UPDATE lrs_runs_data SET afi_runcontrol_json=?, afi_evb_json=?, afi_adc64_sum_json=?, afi_adc64_reg_json=? '
-        + ('WHERE ' + ' OR '.join(where_clauses) if not args.all else 'WHERE 1=1')
-    )
+    cur.executemany(INSERT_AFI_CONFIG, afi.values())
 
-    # We will update each selected row individually by filename to avoid mistakes
-    for fn, runnr in rows:
-        cur.execute(
-            'UPDATE lrs_runs_data SET afi_runcontrol_json=?, afi_evb_json=?, afi_adc64_sum_json=?, afi_adc64_reg_json=? WHERE filename=?',
-            (afi_runcontrol, afi_evb, afi_adc64_sum, afi_adc64_reg, fn)
-        )
+    # Same selection as above, in one statement
+    cur.execute(
+        'UPDATE lrs_runs_data SET afi_runcontrol_ref=?, afi_evb_ref=?, afi_adc64_sum_ref=?, afi_adc64_reg_ref=?, '
+        'afi_runcontrol_json=NULL, afi_evb_json=NULL, afi_adc64_sum_json=NULL, afi_adc64_reg_json=NULL '
+        + where,
+        [afi_runcontrol, afi_evb, afi_adc64_sum, afi_adc64_reg] + params
+    )
 
     conn.commit()
     conn.close()